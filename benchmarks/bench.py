@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+
+"""Benchmark pystyle on generated git repositories.
+
+Repositories of configurable size are generated with `git fast-import`,
+then are timed:
+- each analyzer, on checked out trees and on trees read from the
+  object database, with and without a warm blob cache,
+- checking out random commits, in place and in worktrees,
+- end-to-end runs of infer_style_of_all_repos in various modes,
+- cloning and updating from local file:// remotes.
+
+Results are saved as JSON, and can be compared to a previous run:
+
+    $ python benchmarks/bench.py --output before.json
+    $ python benchmarks/bench.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+
+from pystyle import __version__
+from pystyle.cache import BlobCache
+from pystyle.crawl import git_clone_or_update
+from pystyle.tree import CatFile, GitTree, WorkTree, remove_worktrees, worktree
+from pystyle.update import (
+    FILE_VISITORS,
+    METHODS,
+    Options,
+    analyzers_to_run,
+    file_visitors,
+    infer_style_of_all_repos,
+    pick_random_commit,
+    random_commit,
+)
+from pystyle.walk import walk
+
+logger = logging.getLogger(__name__)
+
+Measure = Dict[str, Union[float, List[float]]]
+
+MIT_LICENSE = """MIT License
+
+Copyright (c) 2020 Bench Mark
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line parameters
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="count",
+        default=0,
+    )
+    parser.add_argument(
+        "--repos",
+        help="Number of generated repos (default: %(default)s)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--files",
+        help="Number of Python files per repo (default: %(default)s)",
+        type=int,
+        default=300,
+    )
+    parser.add_argument(
+        "--depth",
+        help="Number of commits per repo (default: %(default)s)",
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        "--vendored",
+        help="Number of files in vendored trees (bundled virtualenv, vendor/) "
+        "per repo (default: %(default)s)",
+        type=int,
+        default=200,
+    )
+    parser.add_argument(
+        "--json-size",
+        metavar="MB",
+        help="Size of a large JSON file added to each repo (default: %(default)s)",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of runs of each benchmark (default: %(default)s)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--seed", help="Seed of the generated repos", type=int, default=0
+    )
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        help="Where to generate repos, kept after the run, must not exist "
+        "(default: a temporary directory)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("benchmark.json"),
+        help="Where to save the results (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--compare", type=Path, help="Results of a previous run to compare with"
+    )
+    return parser.parse_args()
+
+
+def measure(function: Callable[[], object], repeat: int) -> Measure:
+    """Time `repeat` calls to the given function.
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def python_file(rng: random.Random, number: int, revision: int) -> bytes:
+    """Content of a generated Python file, with some shebangs, some
+    __future__ imports, and some PEP 8 infringements.
+    """
+    lines = []
+    if number % 5 == 0:
+        lines.append(rng.choice(("#!/usr/bin/env python", "#!/usr/bin/python3")))
+    if number % 7 == 0:
+        lines.append("from __future__ import annotations")
+    lines.append("import unittest" if number % 3 == 0 else "import os")
+    for function in range(rng.randint(5, 40)):
+        lines.append("")
+        lines.append("")
+        lines.append(f"def function_{function}(value):")
+        lines.append(f'    """Function {function} of revision {revision}."""')
+        lines.append("    x=value+1" if rng.random() < 0.3 else "    x = value + 1")
+        lines.append("    return x")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def big_json(size: int) -> bytes:
+    """A JSON document of about the given size, in bytes.
+    """
+    item = b'  {"key": "value", "number": 123456789},\n'
+    return b"[\n" + item * (size // len(item)) + b'  {"key": "value"}\n]\n'
+
+
+def make_repo(path: Path, args: argparse.Namespace, seed: int) -> None:
+    """Generate a git repository of the requested size, in a single
+    `git fast-import` run.
+    """
+    rng = random.Random(seed)
+    path.mkdir(parents=True)
+    subprocess.run(("git", "init", "-q", str(path)), check=True)
+    subprocess.run(
+        ("git", "-C", str(path), "symbolic-ref", "HEAD", "refs/heads/master"),
+        check=True,
+    )
+    python_files = [f"package/module_{number}.py" for number in range(args.files)]
+    files: Dict[str, bytes] = {
+        file_path: python_file(rng, number, 0)
+        for number, file_path in enumerate(python_files)
+    }
+    files["LICENSE"] = MIT_LICENSE.encode()
+    files["README.rst"] = b"Run the tests with pytest.\n"
+    files["requirements.txt"] = b"requests>=2\nattrs\n"
+    files["setup.py"] = (
+        b"from setuptools import setup\n\n"
+        b'setup(name="bench", install_requires=["requests>=2", "attrs"])\n'
+    )
+    files["tests/conftest.py"] = b"import pytest\n"
+    files["data/big.json"] = big_json(args.json_size * 1024 * 1024)
+    for number in range(args.vendored):
+        vendored_dir = "venv/lib/python3.8/site-packages" if number % 2 else "vendor"
+        files[f"{vendored_dir}/lib_{number % 10}/module_{number}.py"] = python_file(
+            rng, number, 0
+        )
+    stream = []
+    for revision in range(args.depth):
+        if revision:
+            changes = rng.sample(python_files, min(len(python_files), 10))
+            changed = {
+                file_path: python_file(rng, revision, revision) for file_path in changes
+            }
+        else:
+            changed = files
+        message = f"Revision {revision}".encode()
+        stream.append(b"commit refs/heads/master\n")
+        stream.append(b"mark :%d\n" % (revision + 1))
+        stream.append(
+            b"committer Bench <bench@example.com> %d +0000\n"
+            % (1_500_000_000 + revision * 86400)
+        )
+        stream.append(b"data %d\n%s\n" % (len(message), message))
+        if revision:
+            stream.append(b"from :%d\n" % revision)
+        for file_path, content in changed.items():
+            stream.append(b"M 100644 inline %s\n" % file_path.encode())
+            stream.append(b"data %d\n%s\n" % (len(content), content))
+    subprocess.run(
+        ("git", "-C", str(path), "fast-import", "--quiet"),
+        input=b"".join(stream),
+        check=True,
+    )
+    subprocess.run(
+        ("git", "-C", str(path), "checkout", "-q", "-f", "master"), check=True
+    )
+    subprocess.run(
+        ("git", "-C", str(path), "config", "uploadpack.allowFilter", "true"), check=True
+    )
+
+
+def bench_analyzers(repo: Path, repeat: int, workdir: Path) -> Dict[str, Measure]:
+    """Time each analyzer, and a walk of all file visitors, on checked
+    out trees and on trees read from the object database.
+    """
+    results = {}
+    with CatFile(repo) as cat_file:
+        make_trees = {
+            "worktree": lambda: WorkTree(repo),
+            "gittree": lambda: GitTree(repo, "HEAD", cat_file),
+        }
+        for tree_kind, make_tree in make_trees.items():
+            for name, method in METHODS.items():
+                results[f"analyzer:{name}:{tree_kind}"] = measure(
+                    lambda: method(make_tree()), repeat
+                )
+            for name, visitor_class in FILE_VISITORS.items():
+                results[f"analyzer:{name}:{tree_kind}"] = measure(
+                    lambda: walk(make_tree(), [visitor_class()]), repeat
+                )
+            visitors = file_visitors(analyzers_to_run())
+            results[f"walk:{tree_kind}"] = measure(
+                lambda: walk(make_tree(), visitors), repeat
+            )
+            cache_path = workdir / f"cache-{tree_kind}.sqlite"
+
+            def cached_walk():
+                with BlobCache(cache_path) as cache:
+                    walk(make_tree(), visitors, cache)
+
+            cached_walk()
+            results[f"walk:{tree_kind}:warm-cache"] = measure(cached_walk, repeat)
+    return results
+
+
+def bench_checkouts(repo: Path, repeat: int) -> Dict[str, Measure]:
+    """Time checking out random commits, in place and in a worktree.
+    """
+
+    def in_place():
+        with random_commit(repo):
+            pass
+
+    def in_worktree():
+        with worktree(repo, pick_random_commit(repo)):
+            pass
+
+    results = {"checkout:random_commit": measure(in_place, repeat)}
+    results["checkout:worktree"] = measure(in_worktree, repeat)
+    remove_worktrees(repo)
+    return results
+
+
+def bench_end_to_end(git_store: Path, repeat: int, workdir: Path) -> Dict[str, Measure]:
+    """Time whole runs of infer_style_of_all_repos in various modes.
+    """
+    cache = workdir / "cache-end-to-end.sqlite"
+    modes = {
+        "checkout": Options(),
+        "no-checkout": Options(checkout=False),
+        "no-checkout:warm-cache": Options(checkout=False, cache=cache),
+        "commits:4": Options(commits=4),
+        "history:10": Options(checkout=False, history=10),
+    }
+    infer_style_of_all_repos(
+        git_store, workdir / "warm-up.csv", modes["no-checkout:warm-cache"]
+    )
+    return {
+        f"end-to-end:{name}": measure(
+            lambda: infer_style_of_all_repos(git_store, workdir / "stats.csv", options),
+            repeat,
+        )
+        for name, options in modes.items()
+    }
+
+
+def bench_clones(repo: Path, repeat: int, workdir: Path) -> Dict[str, Measure]:
+    """Time cloning the given repo from a file:// remote, and updating
+    an up to date clone.
+    """
+    url = repo.resolve().as_uri()
+    clone_path = workdir / "clone"
+    modes = {
+        "full": (),
+        "blobless": ("--filter=blob:none",),
+        "shallow": ("--depth", "1"),
+    }
+    results = {}
+    for name, clone_args in modes.items():
+
+        def clone():
+            shutil.rmtree(clone_path, ignore_errors=True)
+            git_clone_or_update(url, str(clone_path), clone_args)
+
+        results[f"clone:{name}"] = measure(clone, repeat)
+    results["clone:unchanged"] = measure(
+        lambda: git_clone_or_update(url, str(clone_path)), repeat
+    )
+    shutil.rmtree(clone_path)
+    return results
+
+
+def run(args: argparse.Namespace, workdir: Path) -> Dict[str, Measure]:
+    """Generate the repos, then run all benchmarks.
+    """
+    git_store = workdir / "clones"
+    repos = [
+        git_store / "example.com" / "bench" / f"repo{i}" for i in range(args.repos)
+    ]
+    start = time.perf_counter()
+    for seed, repo in enumerate(repos, start=args.seed):
+        make_repo(repo, args, seed)
+    logger.info("Generated %d repos in %.1fs", len(repos), time.perf_counter() - start)
+    results = {}
+    for name, benchmark in (
+        ("analyzers", lambda: bench_analyzers(repos[0], args.repeat, workdir)),
+        ("checkouts", lambda: bench_checkouts(repos[0], args.repeat)),
+        ("end-to-end", lambda: bench_end_to_end(git_store, args.repeat, workdir)),
+        ("clones", lambda: bench_clones(repos[0], args.repeat, workdir)),
+    ):
+        logger.info("Running %s benchmarks", name)
+        results.update(benchmark())
+    return results
+
+
+def median(measure: Measure) -> float:
+    """Median time of a measure, as read back from a JSON report too.
+    """
+    value = measure["median"]
+    if not isinstance(value, (int, float)):
+        raise ValueError(f"Not a median time: {value!r}")
+    return value
+
+
+def compare(results: Dict[str, Measure], previous: Dict[str, Measure]) -> None:
+    """Print the median time of each benchmark, next to the one of a
+    previous run.
+    """
+    print(f"{'benchmark':45} {'before':>9} {'after':>9} {'ratio':>6}")
+    for name, result in results.items():
+        after = median(result)
+        if name not in previous:
+            print(f"{name:45} {'':>9} {after:9.4f}")
+            continue
+        before = median(previous[name])
+        ratio = after / before if before else float("inf")
+        print(f"{name:45} {before:9.4f} {after:9.4f} {ratio:6.2f}")
+
+
+def main() -> None:
+    """Main entry point allowing external calls
+    """
+    args = parse_args()
+    logging.basicConfig(
+        level=50 - (args.loglevel * 10),
+        stream=sys.stdout,
+        format="[%(asctime)s] %(levelname)s:%(name)s:%(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    if args.workdir:
+        results = run(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="pystyle-bench-") as workdir:
+            results = run(args, Path(workdir))
+    report = {
+        "parameters": {
+            key: value
+            for key, value in vars(args).items()
+            if key
+            in ("repos", "files", "depth", "vendored", "json_size", "repeat", "seed")
+        },
+        "pystyle": __version__,
+        "python": platform.python_version(),
+        "git": subprocess.check_output(
+            ("git", "--version"), universal_newlines=True
+        ).strip(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text())["results"])
+
+
+if __name__ == "__main__":
+    main()
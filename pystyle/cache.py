@@ -0,0 +1,145 @@
+"""Content-addressed cache of the facts file-level analyzers extract
+from git blobs, shared by all runs and all workers.
+"""
+
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS facts (
+    blob TEXT NOT NULL,
+    analyzer TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    facts TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (blob, analyzer, version)
+);
+CREATE INDEX IF NOT EXISTS facts_last_used ON facts (last_used);
+CREATE TABLE IF NOT EXISTS total_size (size INTEGER NOT NULL);
+INSERT INTO total_size
+    SELECT (SELECT COALESCE(SUM(size), 0) FROM facts)
+    WHERE NOT EXISTS (SELECT * FROM total_size);
+CREATE TRIGGER IF NOT EXISTS facts_inserted AFTER INSERT ON facts BEGIN
+    UPDATE total_size SET size = size + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS facts_deleted AFTER DELETE ON facts BEGIN
+    UPDATE total_size SET size = size - old.size;
+END;
+CREATE TRIGGER IF NOT EXISTS facts_updated AFTER UPDATE OF size ON facts BEGIN
+    UPDATE total_size SET size = size - old.size + new.size;
+END;
+"""
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+Key = Tuple[str, str, int]
+
+
+class BlobCache:
+    """SQLite backed cache of (blob SHA, analyzer, analyzer version) → facts.
+
+    Lookups hit the database, but writes are buffered and flushed in a
+    single short transaction when the cache is closed, so concurrent
+    workers don't wait on each other. Least recently used entries are
+    evicted to keep the database under max_size bytes, tracked by
+    triggers in the one-row total_size table so it's never summed.
+    """
+
+    def __init__(self, path: Path, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.hits: List[Key] = []
+        self.new_facts: Dict[Key, str] = {}
+        self.connection = sqlite3.connect(str(path), timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> "BlobCache":
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+
+    def get(self, blob: str, analyzer: str, version: int) -> Optional[Dict[str, int]]:
+        """Get the facts previously stored for a blob, or None.
+        """
+        key = (blob, analyzer, version)
+        if key in self.new_facts:
+            return json.loads(self.new_facts[key])
+        row = self.connection.execute(
+            "SELECT facts FROM facts WHERE blob = ? AND analyzer = ? AND version = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        self.hits.append(key)
+        return json.loads(row[0])
+
+    def put(self, blob: str, analyzer: str, version: int, facts: Dict[str, int]):
+        """Store the facts an analyzer found in a blob.
+        """
+        self.new_facts[(blob, analyzer, version)] = json.dumps(facts)
+
+    def flush(self):
+        """Write buffered facts and access times, then evict if needed.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE facts SET last_used = ? "
+                "WHERE blob = ? AND analyzer = ? AND version = ?",
+                ((now, *key) for key in self.hits),
+            )
+            self.connection.executemany(
+                "INSERT INTO facts VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (blob, analyzer, version) DO UPDATE SET "
+                "facts = excluded.facts, size = excluded.size, "
+                "last_used = excluded.last_used",
+                (
+                    (*key, facts, sum(map(len, key[:2])) + len(facts) + 32, now)
+                    for key, facts in self.new_facts.items()
+                ),
+            )
+        self.hits = []
+        self.new_facts = {}
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache is back
+        under 90% of its maximum size.
+        """
+        (size,) = self.connection.execute("SELECT size FROM total_size").fetchone()
+        if size <= self.max_size:
+            return
+        to_free = size - self.max_size * 9 // 10
+        to_delete = []
+        for rowid, row_size in self.connection.execute(
+            "SELECT rowid, size FROM facts ORDER BY last_used"
+        ):
+            if to_free <= 0:
+                break
+            to_delete.append((rowid,))
+            to_free -= row_size
+        with self.connection:
+            self.connection.executemany("DELETE FROM facts WHERE rowid = ?", to_delete)
+
+
+@contextmanager
+def open_cache(
+    path: Optional[Path], max_size: int = DEFAULT_CACHE_SIZE
+) -> Iterator[Optional[BlobCache]]:
+    """Open the cache at the given path, or give None if no path is given.
+    """
+    if path is None:
+        yield None
+        return
+    with BlobCache(path, max_size) as cache:
+        yield cache
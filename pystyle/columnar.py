@@ -0,0 +1,161 @@
+"""Export stats in a columnar format, Parquet or Arrow IPC, so they can
+be loaded column by column, or memory-mapped.
+
+Needs pyarrow, so only import this module when exporting.
+"""
+
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Set,
+    Tuple,
+    Union,
+)
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Metric families with an open-ended set of "family:key" metrics,
+# stored in a single map column instead of a column per key.
+FOLDED = ("shebang", "pep8")
+
+BATCH_SIZE = 10_000
+
+StylesReader = Callable[[], Iterable[Mapping[str, Any]]]
+Dictionaries = Dict[str, pa.Array]
+
+
+def column_of(metric: str) -> str:
+    """Name of the column holding the given metric.
+    """
+    family, colon, _ = metric.partition(":")
+    return family if colon and family in FOLDED else metric
+
+
+def arrow_type(column: str, seen: Set[type]) -> pa.DataType:
+    """Arrow type of a column, given the Python types of its values.
+    """
+    if column in FOLDED or column == "versions":
+        return pa.map_(pa.string(), pa.int64())
+    if column == "requirements":
+        return pa.list_(pa.string())
+    if column == "date":
+        return pa.timestamp("s", tz="UTC")
+    if column == "commit":
+        return pa.string()
+    if seen <= {int, bool, type(None)}:
+        return pa.int64()
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def arrow_schema(read_styles: StylesReader) -> Tuple[pa.Schema, Dictionaries]:
+    """Schema of the columns needed by all the given stats, and the
+    values of its dictionary encoded columns, so all batches share the
+    same dictionaries.
+    """
+    types: Dict[str, Set[type]] = {}
+    values: Dict[str, Dict[str, None]] = {}
+    for style in read_styles():
+        for metric, value in style.items():
+            column = column_of(metric)
+            types.setdefault(column, set()).add(type(value))
+            if value is not None:
+                values.setdefault(column, {})[str(value)] = None
+    schema = pa.schema(
+        [pa.field(column, arrow_type(column, seen)) for column, seen in types.items()]
+    )
+    dictionaries = {
+        field.name: pa.array(list(values.get(field.name, {})), pa.string())
+        for field in schema
+        if pa.types.is_dictionary(field.type)
+    }
+    return schema, dictionaries
+
+
+def to_row(style: Mapping[str, Any]) -> Dict[str, Any]:
+    """Convert the stats of a commit to the values of a row.
+    """
+    row: Dict[str, Any] = {}
+    for metric, value in style.items():
+        column = column_of(metric)
+        if column in FOLDED:
+            row.setdefault(column, []).append((metric.partition(":")[2], value))
+        elif column == "versions":
+            row[column] = list(json.loads(value).items())
+        elif column == "requirements":
+            row[column] = json.loads(value)
+        elif column == "date":
+            row[column] = datetime.fromisoformat(value)
+        else:
+            row[column] = value
+    return row
+
+
+def to_batch(
+    rows: List[Dict[str, Any]], schema: pa.Schema, dictionaries: Dictionaries
+) -> pa.RecordBatch:
+    """Convert rows to a record batch, encoding dictionary columns with
+    the given dictionaries instead of ones built from the rows.
+    """
+    for row in rows:
+        for column in dictionaries.keys() & row.keys():
+            if row[column] is not None:
+                row[column] = str(row[column])
+    plain_schema = pa.schema(
+        [
+            pa.field(field.name, pa.string()) if field.name in dictionaries else field
+            for field in schema
+        ]
+    )
+    arrays = pa.RecordBatch.from_pylist(rows, schema=plain_schema).columns
+    for index, field in enumerate(schema):
+        if field.name in dictionaries:
+            dictionary = dictionaries[field.name]
+            indices = pc.index_in(arrays[index], value_set=dictionary)
+            arrays[index] = pa.DictionaryArray.from_arrays(
+                indices.cast(pa.int32()), dictionary
+            )
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def record_batches(
+    read_styles: StylesReader, schema: pa.Schema, dictionaries: Dictionaries
+) -> Iterator[pa.RecordBatch]:
+    """Convert the given stats to record batches of BATCH_SIZE rows.
+    """
+    rows: List[Dict[str, Any]] = []
+    for style in read_styles():
+        rows.append(to_row(style))
+        if len(rows) == BATCH_SIZE:
+            yield to_batch(rows, schema, dictionaries)
+            rows = []
+    if rows:
+        yield to_batch(rows, schema, dictionaries)
+
+
+def export_columnar(read_styles: StylesReader, path: Path) -> None:
+    """Write stats to a Parquet file, or to an Arrow IPC file if its
+    suffix is .arrow or .feather.
+
+    Stats are read twice, first to find the columns, their types and
+    the values of dictionary encoded columns, then to write them batch
+    by batch.
+    """
+    schema, dictionaries = arrow_schema(read_styles)
+    writer: Union[pa.ipc.RecordBatchFileWriter, pq.ParquetWriter]
+    if path.suffix in (".arrow", ".feather"):
+        writer = pa.ipc.new_file(str(path), schema)
+    else:
+        writer = pq.ParquetWriter(str(path), schema)
+    with writer:
+        for batch in record_batches(read_styles, schema, dictionaries):
+            writer.write_batch(batch)
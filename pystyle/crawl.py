@@ -3,25 +3,114 @@
 """
 
 import argparse
+import functools
+import json
 import logging
 import os
 import re
 import shutil
 import subprocess
 import sys
-from multiprocessing import Pool
-from pathlib import Path
-from typing import Union
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Union
 from urllib.parse import urlparse
 
 import feedparser
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
 from pystyle import __version__
 
 logger = logging.getLogger(__name__)
 
+PYPI_URL = "https://pypi.org"
+PYTHONWHEELS_URL = "https://pythonwheels.com/results.json"
+
+
+def add_crawl_arguments(
+    parser: argparse.ArgumentParser, clone_jobs: Sequence[str] = ("-j", "--jobs")
+) -> None:
+    """Add the options telling what to crawl and how to clone it, shared
+    by pystyle-crawl and pystyle-pipeline, which already has a --jobs
+    option so it names the number of parallel clones differently.
+    """
+    parser.add_argument(
+        "--repository",
+        help="Crawl a specific repository",
+        metavar="https://github.com/julienpalard/pystyle/",
+        type=str,
+    )
+    parser.add_argument("--pypi-project", help="Fetch a single PyPI project")
+    parser.add_argument(
+        "--top360",
+        help="Download the top360 packets from pythonwheels.com",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="Number of PyPI projects crawled in parallel (default: %(default)s)",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        *clone_jobs,
+        dest="clone_jobs",
+        metavar="JOBS",
+        help="Number of repositories cloned or updated in parallel "
+        "(default: %(default)s)",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--per-host",
+        help="Maximum number of parallel clones from a single host "
+        "(default: %(default)s)",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--retries",
+        help="Number of retries of a failed clone (default: %(default)s)",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--blobless",
+        help="Clone without file contents, git fetches them on demand for the "
+        "analyzed commits",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--depth", help="Only clone the last DEPTH commits of each repository", type=int
+    )
+    parser.add_argument(
+        "--rate",
+        help="Maximum number of HTTP requests per second to a single host "
+        "(default: %(default)s, 0 for no limit)",
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        "--resolved",
+        help="JSON file remembering the github URL of PyPI projects "
+        "(default: .pypi-resolved.json in git_store)",
+        type=Path,
+    )
+    parser.add_argument(
+        "--pypi-url", help="Base URL of PyPI (default: %(default)s)", default=PYPI_URL,
+    )
+    parser.add_argument(
+        "--pythonwheels-url",
+        help="URL of the pythonwheels.com results used by --top360 "
+        "(default: %(default)s)",
+        default=PYTHONWHEELS_URL,
+    )
+
 
 def parse_args():
     """Parse command line parameters
@@ -51,24 +140,13 @@ def parse_args():
         action="store_const",
         const=logging.DEBUG,
     )
-    parser.add_argument(
-        "--repository",
-        help="Crawl a specific repository",
-        metavar="https://github.com/julienpalard/pystyle/",
-        type=str,
-    )
-    parser.add_argument("--pypi-project", help="Fetch a single PyPI project")
     parser.add_argument(
         "git_store", metavar="./git-clones/", help="Directory to store git clones."
     )
     parser.add_argument(
         "--reclone", help="Re clone from given pystyle-data to git_store."
     )
-    parser.add_argument(
-        "--top360",
-        help="Download the top360 packets from pythonwheels.com",
-        action="store_true",
-    )
+    add_crawl_arguments(parser)
     return parser.parse_args()
 
 
@@ -84,6 +162,47 @@ def setup_logging(loglevel):
     )
 
 
+class RateLimiter:
+    """Space out requests to a same host, shared between threads.
+    """
+
+    def __init__(self, per_second: float) -> None:
+        self.interval = 1 / per_second if per_second else 0
+        self.next_slot: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        """Block until a request to the host of the given URL is allowed.
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        time.sleep(slot - now)
+
+
+class Fetcher:
+    """HTTP client for the crawling threads: a single session keeping
+    connections alive, rate limited per host.
+    """
+
+    def __init__(self, concurrency: int = 8, rate: float = 10, timeout: float = 30):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.rate_limiter = RateLimiter(rate)
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Rate limited GET request.
+        """
+        self.rate_limiter.wait(url)
+        return self.session.get(url, timeout=self.timeout, **kwargs)
+
+
 def is_github_project_url(url):
     """Returns True if the URL looks like a github project URL. False
     otherwise.
@@ -91,31 +210,120 @@ def is_github_project_url(url):
     return re.match("https://github.com/[^/]+/[^/]+/?", url) is not None
 
 
-def git_clone_or_update(clone_url, clone_path):
+def remote_head(clone_url: str) -> str:
+    """Ask the remote for the commit its HEAD points to, without fetching.
+    """
+    ls_remote = subprocess.run(
+        ["git", "ls-remote", clone_url, "HEAD"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout
+    return ls_remote.split("\t", 1)[0]
+
+
+def local_head(clone_path) -> Optional[str]:
+    """Commit currently checked out in a clone, if any.
+    """
+    try:
+        return subprocess.run(
+            ["git", "-C", clone_path, "rev-parse", "-q", "--verify", "HEAD"],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        ).stdout.strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def git_force_update(clone_path) -> None:
+    """Fetch and reset the clone to the remote default branch, for clones
+    that diverged or have a detached HEAD.
+    """
+    subprocess.run(["git", "-C", clone_path, "fetch", "--force", "origin"], check=True)
+    upstream = subprocess.run(
+        [
+            "git",
+            "-C",
+            clone_path,
+            "symbolic-ref",
+            "--short",
+            "refs/remotes/origin/HEAD",
+        ],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout.strip()
+    subprocess.run(
+        ["git", "-C", clone_path, "checkout", "-f", "-B"]
+        + [upstream.split("/", 1)[1], upstream],
+        check=True,
+    )
+
+
+def git_clone_or_update(clone_url, clone_path, clone_args: Sequence[str] = ()):
     """Wrapper around git clone / git pull, just try to get an up-to-date
-    repo.
+    repo. clone_args are given to git clone, like "--filter=blob:none"
+    for a partial clone.
+
+    Existing clones whose HEAD is already the remote HEAD are left
+    untouched, diverged ones are forcibly updated.
+
+    Returns "unchanged", "updated" or "cloned", raises
+    CalledProcessError if the repo could not be reached or cloned.
     """
     if os.path.isdir(clone_path):
+        if remote_head(clone_url) == local_head(clone_path):
+            logger.debug("Already up to date: %s", clone_path)
+            return "unchanged"
         logger.debug("Git pull on: %s", clone_path)
         try:
             subprocess.run(["git", "-C", clone_path, "pull", "--ff-only"], check=True)
-            return
+            return "updated"
+        except subprocess.CalledProcessError:
+            pass
+        logger.debug("Forced update of: %s", clone_path)
+        try:
+            git_force_update(clone_path)
+            return "updated"
         except subprocess.CalledProcessError:
             shutil.rmtree(clone_path)
     os.makedirs(clone_path)
     logger.debug("Git clone: %s", clone_url)
     try:
         subprocess.run(
-            ["git", "clone", clone_url, clone_path],
+            ["git", "clone", *clone_args, clone_url, clone_path],
             stdin=subprocess.DEVNULL,
             check=True,
         )
     except subprocess.CalledProcessError:
         logger.error("Clone failed for repo %s", clone_url)
         shutil.rmtree(clone_path, ignore_errors=True)
+        raise
+    return "cloned"
+
+
+def clone_arguments(blobless: bool = False, depth: Optional[int] = None) -> List[str]:
+    """Arguments given to git clone for blobless or shallow clones.
+    """
+    clone_args = []
+    if blobless:
+        clone_args.append("--filter=blob:none")
+    if depth:
+        clone_args.extend(("--depth", str(depth)))
+    return clone_args
+
+
+def local_clone_path(github_project_url, clones_path) -> str:
+    """Where the given github project is cloned in clones_path.
+    """
+    return os.path.join(clones_path, urlparse(github_project_url.rstrip("/")).path[1:])
 
 
-def clone_repository(github_project_url, clones_path=None, clone_path=None):
+def clone_repository(
+    github_project_url, clones_path=None, clone_path=None, clone_args=()
+):
     """Clone or update the given github project by URL.
     Give one of clones_path or clone_path:
     - Will clone the project in a directory in clones_path.
@@ -124,66 +332,306 @@ def clone_repository(github_project_url, clones_path=None, clone_path=None):
     github_project_url = github_project_url.rstrip("/")
     clone_url = github_project_url + ".git"
     if clones_path:
-        clone_path = os.path.join(clones_path, urlparse(github_project_url).path[1:])
-    git_clone_or_update(clone_url, clone_path)
+        clone_path = local_clone_path(github_project_url, clones_path)
+    return git_clone_or_update(clone_url, clone_path, clone_args)
 
 
-def pypi_url_to_github_url(pypi_package_url):
-    """By querying the PyPI API, try to find the github page of a pypi project.
+class CloneScheduler:
+    """Clone or update repositories in a bounded pool of threads, with a
+    cap on concurrent clones per host and retries with exponential
+    backoff. Logs progress, and a summary on exit.
+
+    If given, on_done is called with the URL and the outcome of each
+    finished clone, from the thread that did it.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        jobs: int = 4,
+        per_host: int = 4,
+        retries: int = 2,
+        backoff: float = 10,
+        clone_args: Sequence[str] = (),
+        on_done: Optional[Callable[[str, str], None]] = None,
+    ) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.on_done = on_done
+        self.clone_args = clone_args
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.host_slots: Dict[str, threading.Semaphore] = {}
+        self.outcomes: Counter = Counter()
+        self.failed: List[str] = []
+        self.submitted = 0
+
+    def __enter__(self) -> "CloneScheduler":
+        return self
+
+    def __exit__(self, *exc):
+        self.executor.shutdown(wait=True)
+        self.report()
+
+    def host_slot(self, url: str) -> threading.Semaphore:
+        """Semaphore limiting concurrent clones from the host of the URL.
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.Semaphore(self.per_host)
+            return self.host_slots[host]
+
+    def submit(self, github_project_url: str, clones_path) -> Future:
+        """Schedule a clone or update of the given project in clones_path.
+        """
+        with self.lock:
+            self.submitted += 1
+        future = self.executor.submit(self.clone, github_project_url, clones_path)
+        future.add_done_callback(functools.partial(self.done, github_project_url))
+        return future
+
+    def clone(self, github_project_url: str, clones_path) -> str:
+        """Clone or update a project, retrying on failures.
+        """
+        attempt = 0
+        while True:
+            try:
+                with self.host_slot(github_project_url):
+                    return clone_repository(
+                        github_project_url,
+                        clones_path=clones_path,
+                        clone_args=self.clone_args,
+                    )
+            except subprocess.CalledProcessError:
+                if attempt >= self.retries:
+                    raise
+            delay = self.backoff * 2 ** attempt
+            logger.info("Retrying %s in %.0fs", github_project_url, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def done(self, github_project_url: str, future: Future) -> None:
+        """Account for a finished clone.
+        """
+        outcome = "failed" if future.exception() else future.result()
+        with self.lock:
+            self.outcomes[outcome] += 1
+            if outcome == "failed":
+                self.failed.append(github_project_url)
+            finished = sum(self.outcomes.values())
+            logger.info(
+                "[%d/%d] %s %s", finished, self.submitted, outcome, github_project_url
+            )
+        if self.on_done is not None:
+            self.on_done(github_project_url, outcome)
+
+    def report(self) -> None:
+        """Log a summary of all clones.
+        """
+        logger.info(
+            "%d repositories: %d cloned, %d updated, %d unchanged, %d failed",
+            self.submitted,
+            self.outcomes["cloned"],
+            self.outcomes["updated"],
+            self.outcomes["unchanged"],
+            self.outcomes["failed"],
+        )
+        for github_project_url in self.failed:
+            logger.error("Failed to clone or update %s", github_project_url)
+
+
+class ResolvedProjects:
+    """Persistent map of PyPI project names to their github URL, with the
+    ETag of the metadata they were resolved from, shared between threads.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.projects: Dict[str, Dict[str, Optional[str]]] = {}
+        if path is not None and path.exists():
+            self.projects = json.loads(path.read_text())
+
+    def get(self, name: str) -> Optional[Dict[str, Optional[str]]]:
+        """Get the etag and github_url known for a project, if any.
+        """
+        with self.lock:
+            return self.projects.get(name)
+
+    def set(self, name: str, etag: Optional[str], github_url: Optional[str]):
+        """Remember how a project got resolved.
+        """
+        with self.lock:
+            self.projects[name] = {"etag": etag, "github_url": github_url}
+
+    def save(self):
+        """Write the map back to disk, atomically.
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            content = json.dumps(self.projects, indent=1, sort_keys=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(content)
+        tmp_path.replace(self.path)
+
+
+def to_github_project_url(url: Optional[str]) -> Optional[str]:
+    """Reduce a URL pointing somewhere inside a github project to the
+    project URL, or give None for non-github URLs.
+    """
+    match = re.match(r"https?://(?:www\.)?github\.com/([^/#?]+)/([^/#?]+)", url or "")
+    if match is None:
+        return None
+    org, project = match.groups()
+    if project.endswith(".git"):
+        project = project[: -len(".git")]
+    return f"https://github.com/{org}/{project}"
+
+
+def github_url_from_metadata(info: dict) -> Optional[str]:
+    """Find a github project URL in the "info" part of PyPI JSON metadata.
     """
-    project_response = requests.get(pypi_package_url)
-    soup = BeautifulSoup(project_response.content, "html5lib", from_encoding="UTF8")
+    candidates = list((info.get("project_urls") or {}).values())
+    candidates.append(info.get("home_page"))
+    for candidate in candidates:
+        github_url = to_github_project_url(candidate)
+        if github_url:
+            return github_url
+    return None
+
+
+def github_url_from_html(project_page: bytes) -> Optional[str]:
+    """Find the github project URL in the sidebar of a PyPI project page.
+    """
+    soup = BeautifulSoup(project_page, "html.parser", from_encoding="UTF8")
     for element in soup.select("div.sidebar-section a i.fa-github"):
-        github_url = element.parent.get("href")
-        if is_github_project_url(github_url):
+        github_url = element.parent.get("href") if element.parent else None
+        if isinstance(github_url, str) and is_github_project_url(github_url):
             return github_url
     return None
 
 
-def crawl_pypi_project(git_store, pypi_package_url):
+def pypi_project_name(pypi_package_url: str) -> str:
+    """Name of the project a PyPI URL points to, like requests for
+    https://pypi.org/project/requests/ or for the release page
+    https://pypi.org/project/requests/2.31.0/ given by the updates feed.
+    """
+    parts = PurePosixPath(urlparse(pypi_package_url).path).parts
+    for index, part in enumerate(parts[:-1]):
+        if part in ("project", "pypi"):
+            return parts[index + 1]
+    return parts[-1]
+
+
+def pypi_url_to_github_url(
+    pypi_package_url,
+    fetcher: Optional[Fetcher] = None,
+    resolved: Optional[ResolvedProjects] = None,
+):
+    """By querying the PyPI API, try to find the github page of a pypi project.
+
+    The JSON metadata is revalidated using the ETag of the last
+    resolution, the HTML page is only parsed if the JSON API fails.
+    """
+    fetcher = fetcher or Fetcher()
+    resolved = resolved or ResolvedProjects()
+    url = urlparse(pypi_package_url)
+    name = pypi_project_name(pypi_package_url)
+    known = resolved.get(name)
+    headers = {"If-None-Match": known["etag"]} if known and known["etag"] else {}
+    response = fetcher.get(
+        f"{url.scheme}://{url.netloc}/pypi/{name}/json", headers=headers
+    )
+    if response.status_code == 304 and known:
+        return known["github_url"]
+    if response.status_code == 200:
+        github_url = github_url_from_metadata(response.json()["info"])
+        resolved.set(name, response.headers.get("ETag"), github_url)
+        return github_url
+    logger.debug("No JSON metadata for %s, parsing its page", pypi_package_url)
+    return github_url_from_html(fetcher.get(pypi_package_url).content)
+
+
+def crawl_pypi_project(
+    git_store,
+    pypi_package_url,
+    fetcher: Optional[Fetcher] = None,
+    resolved: Optional[ResolvedProjects] = None,
+    scheduler: Optional[CloneScheduler] = None,
+):
     """Crawl a PyPI package by trying to find it upstream git and cloning
-    it.
+    it, via the scheduler if one is given.
     """
     logger.info("Crawling %s", pypi_package_url)
-    github_project_url = pypi_url_to_github_url(pypi_package_url)
+    github_project_url = pypi_url_to_github_url(pypi_package_url, fetcher, resolved)
     if github_project_url:
-        clone_repository(github_project_url, clones_path=git_store)
+        if scheduler is None:
+            clone_repository(github_project_url, clones_path=git_store)
+        else:
+            scheduler.submit(github_project_url, git_store)
+
+
+def crawl_pypi_projects(
+    git_store,
+    pypi_package_urls: Iterable[str],
+    fetcher: Fetcher,
+    resolved: ResolvedProjects,
+    scheduler: CloneScheduler,
+) -> None:
+    """Crawl many PyPI packages concurrently, sharing the fetcher
+    connection pool, and hand their repositories to the clone scheduler.
+    """
+
+    def crawl(pypi_package_url):
+        try:
+            crawl_pypi_project(
+                git_store, pypi_package_url, fetcher, resolved, scheduler
+            )
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to crawl %s", pypi_package_url)
+
+    try:
+        with ThreadPoolExecutor(max_workers=fetcher.concurrency) as executor:
+            for _ in executor.map(crawl, pypi_package_urls):
+                pass
+    finally:
+        resolved.save()
 
 
-def crawl_pypi():
+def crawl_pypi(fetcher: Fetcher, pypi_url: str = PYPI_URL):
     """Crawl PyPI via RSS, return a list of pypi projects.
     """
-    updates = feedparser.parse("https://pypi.org/rss/updates.xml")
-    packages = feedparser.parse("https://pypi.org/rss/packages.xml")
+    updates = feedparser.parse(fetcher.get(f"{pypi_url}/rss/updates.xml").content)
+    packages = feedparser.parse(fetcher.get(f"{pypi_url}/rss/packages.xml").content)
     return set(package["link"] for package in updates["items"] + packages["items"])
 
 
-def crawl_pythonwheels():
+def crawl_pythonwheels(
+    fetcher: Fetcher, pypi_url: str = PYPI_URL, pythonwheels_url: str = PYTHONWHEELS_URL
+):
     """Crawl pythonwheels.com, return a list of pypi projects.
     """
-    pythonwheels = requests.get("https://pythonwheels.com/results.json").json()
+    pythonwheels = fetcher.get(pythonwheels_url).json()
     return set(
-        f"https://pypi.org/project/{project['name']}"
-        for project in pythonwheels["data"]
+        f"{pypi_url}/project/{project['name']}" for project in pythonwheels["data"]
     )
 
 
-def reclone(git_store: str, pystyle_data_path: Union[str, Path]) -> None:
+def reclone(
+    git_store: str, pystyle_data_path: Union[str, Path], scheduler: CloneScheduler
+) -> None:
+    """Clone again all repositories having stats in pystyle-data.
+    """
     pystyle_data_path = Path(pystyle_data_path)
     if (pystyle_data_path / Path("github.com")).exists():
         github = pystyle_data_path / Path("github.com")
     else:
         github = pystyle_data_path
-    with Pool(processes=4) as pool:
-        for org in github.iterdir():
-            for project in org.iterdir():
-                pool.apply_async(
-                    clone_repository,
-                    (f"https://github.com/{org.stem}/{project.stem}",),
-                    {"clones_path": git_store},
-                )
-        pool.close()
-        pool.join()
+    for org in github.iterdir():
+        for project in org.iterdir():
+            scheduler.submit(f"https://github.com/{org.stem}/{project.stem}", git_store)
 
 
 def main():
@@ -193,20 +641,40 @@ def main():
     os.environ["GIT_ASKPASS"] = "/bin/true"
     setup_logging(args.loglevel)
     logger.debug("Starting...")
-    if args.repository:
-        clone_repository(args.repository, clones_path=args.git_store)
-    elif args.pypi_project:
-        crawl_pypi_project(args.git_store, args.pypi_project)
-    elif args.top360:
-        pypi_projects = crawl_pythonwheels()
-        for pypi_project in pypi_projects:
-            crawl_pypi_project(args.git_store, pypi_project)
-    elif args.reclone:
-        reclone(args.git_store, args.reclone)
-    else:
-        pypi_projects = crawl_pypi()
-        for pypi_project in pypi_projects:
-            crawl_pypi_project(args.git_store, pypi_project)
+    fetcher = Fetcher(args.concurrency, args.rate)
+    resolved = ResolvedProjects(
+        args.resolved or Path(args.git_store) / ".pypi-resolved.json"
+    )
+    with CloneScheduler(
+        args.clone_jobs,
+        args.per_host,
+        args.retries,
+        clone_args=clone_arguments(args.blobless, args.depth),
+    ) as scheduler:
+        if args.repository:
+            scheduler.submit(args.repository, args.git_store)
+        elif args.pypi_project:
+            crawl_pypi_projects(
+                args.git_store, [args.pypi_project], fetcher, resolved, scheduler
+            )
+        elif args.top360:
+            crawl_pypi_projects(
+                args.git_store,
+                crawl_pythonwheels(fetcher, args.pypi_url, args.pythonwheels_url),
+                fetcher,
+                resolved,
+                scheduler,
+            )
+        elif args.reclone:
+            reclone(args.git_store, args.reclone, scheduler)
+        else:
+            crawl_pypi_projects(
+                args.git_store,
+                crawl_pypi(fetcher, args.pypi_url),
+                fetcher,
+                resolved,
+                scheduler,
+            )
     logger.debug("Script ends here")
 
 
@@ -0,0 +1,42 @@
+"""Fingerprints of common license texts, so most license files are
+identified without running the licensename matcher at all.
+"""
+
+import hashlib
+import re
+from typing import Dict
+
+# Fingerprints of the texts GitHub offers when creating a repository,
+# with and without their title line for the short ones, and of the
+# copies shipped in Debian's /usr/share/common-licenses. Names are the
+# ones licensename gives for the same texts.
+COMMON_LICENSES: Dict[str, str] = {
+    "248f8e5d3d9112590d80cc7f3afa1c1e14f1da88": "MIT",
+    "5cfd520a57af46d9cc76a41b2e5175b84b8bd4ec": "MIT",
+    "4de9ea406b16b748173134cf62c69d49195ef492": "BSD-2-Clause",
+    "67d1d8dd6073da7261d991b3c60618b105c7bce0": "BSD-2-Clause",
+    "f0549440ea71aadbed791dfef0affedfba56423c": "BSD-3-Clause",
+    "fb1dd8c8fdc674928301d19018604f1c8ce40e73": "BSD-3-Clause",
+    "9bd901f5505b80e33b6f2b3fb85113f36d5da258": "ISC",
+    "b3570e2a5b897d2a049fb84ee4971014e67d1ee0": "ISC",
+    "f0147436277695faee6ade35a814634e38cf2c40": "Apache-2.0",
+    "6205103d4a05931c00b82b26909f21709d3ac295": "GPL-2.0",
+    "4b29da29e5e978c87e38669069b16392dc52c232": "GPL-3.0",
+    "a7d691ffbda07fde3aace42a84512317fff2cb53": "LGPL-2.1",
+    "0e860339784eda5972405bc4b5cfca2df00fb18a": "LGPL-3.0",
+    "6669d02389bc2685242f5bad23c3da5f7505e677": "MPL-2.0",
+}
+
+
+def license_fingerprint(text: str) -> str:
+    """Hash a license text, ignoring case, punctuation, whitespace and
+    copyright lines, so copies of a standard license only differing by
+    their copyright holders get the same fingerprint.
+    """
+    kept = [
+        line
+        for line in text.lower().splitlines()
+        if "copyright" not in line and "(c)" not in line
+    ]
+    words = re.findall(r"\w+", "\n".join(kept))
+    return hashlib.sha1(" ".join(words).encode()).hexdigest()
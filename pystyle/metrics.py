@@ -0,0 +1,231 @@
+"""Instrumentation of analyses: wall time, I/O and subprocesses by
+analyzer and by repo, and the report of a whole run.
+"""
+
+import contextlib
+import cProfile
+import heapq
+import itertools
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import (
+    Any,
+    ContextManager,
+    DefaultDict,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+
+class Recorder:
+    """Counters of an analysis, by scope: an analyzer, the walk,
+    checkouts, ...
+
+    Scopes nest, the seconds of a scope include those of the scopes
+    opened within it.
+    """
+
+    def __init__(self) -> None:
+        self.counters: DefaultDict[str, DefaultDict[str, float]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self.scopes = ["other"]
+
+    @contextlib.contextmanager
+    def scope(self, name: str) -> Iterator[None]:
+        """Attribute what happens in the block to the given scope.
+        """
+        self.scopes.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.counters[name]["seconds"] += time.perf_counter() - start
+            self.scopes.pop()
+
+    def count(
+        self, key: str, value: float = 1, scope_name: Optional[str] = None
+    ) -> None:
+        """Add to a counter of the given scope, or of the current one.
+        """
+        self.counters[scope_name or self.scopes[-1]][key] += value
+
+
+RECORDER: Optional[Recorder] = None
+NO_SCOPE = contextlib.nullcontext()
+AUDIT_HOOK_INSTALLED = False
+PROFILE_NUMBERS = itertools.count()
+
+
+def scope(name: str) -> ContextManager[None]:
+    """Attribute what happens in the block to the given scope, if the
+    current analysis is recorded.
+    """
+    if RECORDER is None:
+        return NO_SCOPE
+    return RECORDER.scope(name)
+
+
+def count(key: str, value: float = 1, scope_name: Optional[str] = None) -> None:
+    """Add to a counter of the given scope, or of the current one, if
+    the current analysis is recorded.
+    """
+    if RECORDER is not None:
+        RECORDER.count(key, value, scope_name)
+
+
+def count_subprocesses(event: str, _: Tuple[Any, ...]) -> None:
+    """Audit hook counting the subprocesses spawned in each scope.
+    """
+    if event == "subprocess.Popen" and RECORDER is not None:
+        RECORDER.count("subprocesses")
+
+
+@contextlib.contextmanager
+def recording(
+    enabled: bool, profile_dir: Optional[Path] = None
+) -> Iterator[Dict[str, Any]]:
+    """Record the metrics of an analysis in the yielded dict, filled on
+    exit, optionally saving a cProfile dump in profile_dir.
+    """
+    global RECORDER, AUDIT_HOOK_INSTALLED  # pylint: disable=global-statement
+    record: Dict[str, Any] = {}
+    if not enabled:
+        yield record
+        return
+    if not AUDIT_HOOK_INSTALLED and hasattr(sys, "addaudithook"):
+        sys.addaudithook(count_subprocesses)
+        AUDIT_HOOK_INSTALLED = True
+    RECORDER = Recorder()
+    profiler = cProfile.Profile() if profile_dir is not None else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record["seconds"] = time.perf_counter() - start
+        record["scopes"] = {
+            name: dict(counters) for name, counters in RECORDER.counters.items()
+        }
+        RECORDER = None
+        if profiler is not None and profile_dir is not None:
+            profile = profile_dir / f"{os.getpid()}-{next(PROFILE_NUMBERS)}.prof"
+            profiler.dump_stats(str(profile))
+            record["profile"] = str(profile)
+
+
+def prometheus_labels(**labels: str) -> str:
+    """Format labels of a Prometheus sample.
+    """
+    return ",".join(
+        '{}="{}"'.format(
+            name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels.items()
+    )
+
+
+class MetricsReport:
+    """Metrics of all analyses of a run, keeping the cProfile dumps of
+    the `profiles` slowest ones.
+    """
+
+    def __init__(self, profiles: int = 0) -> None:
+        self.profiles = profiles
+        self.totals: DefaultDict[str, DefaultDict[str, float]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self.analyses: List[Dict[str, Any]] = []
+        self.slowest: List[Tuple[float, int, str, str, str]] = []
+
+    def add(self, repo: str, commit: str, record: Dict[str, Any]) -> None:
+        """Add the record of the analysis of a commit.
+        """
+        for name, counters in record["scopes"].items():
+            for key, value in counters.items():
+                self.totals[name][key] += value
+        self.analyses.append(
+            {
+                "repo": repo,
+                "commit": commit,
+                "seconds": record["seconds"],
+                "scopes": record["scopes"],
+            }
+        )
+        if "profile" not in record:
+            return
+        heapq.heappush(
+            self.slowest,
+            (record["seconds"], len(self.analyses), record["profile"], repo, commit),
+        )
+        if len(self.slowest) > self.profiles:
+            *_, profile, _, _ = heapq.heappop(self.slowest)
+            os.remove(profile)
+
+    def keep_profiles(self) -> List[str]:
+        """Give the kept cProfile dumps readable names, slowest first.
+        """
+        kept = []
+        for rank, (_, _, profile, repo, commit) in enumerate(
+            sorted(self.slowest, reverse=True), start=1
+        ):
+            name = f"{rank:03}-{repo.replace('/', '_')}-{commit[:12]}.prof"
+            os.replace(profile, Path(profile).with_name(name))
+            kept.append(str(Path(profile).with_name(name)))
+        return kept
+
+    def write(self, path: Path) -> None:
+        """Write the report as a Prometheus text file if its name ends
+        with .prom, as JSON otherwise.
+        """
+        profiles = self.keep_profiles()
+        self.analyses.sort(key=lambda analysis: analysis["seconds"], reverse=True)
+        if path.suffix == ".prom":
+            path.write_text(self.to_prometheus())
+            return
+        path.write_text(
+            json.dumps(
+                {
+                    "analyses": len(self.analyses),
+                    "seconds": sum(analysis["seconds"] for analysis in self.analyses),
+                    "scopes": self.totals,
+                    "profiles": profiles,
+                    "by_repo": self.analyses,
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+
+    def to_prometheus(self, slowest: int = 20) -> str:
+        """Totals by scope, and the durations of the slowest analyses,
+        in the Prometheus text format.
+        """
+        lines = [
+            "# TYPE pystyle_analyses_total counter",
+            f"pystyle_analyses_total {len(self.analyses)}",
+        ]
+        keys = sorted({key for counters in self.totals.values() for key in counters})
+        for key in keys:
+            lines.append(f"# TYPE pystyle_{key}_total counter")
+            for name, counters in sorted(self.totals.items()):
+                if key in counters:
+                    lines.append(
+                        f"pystyle_{key}_total{{{prometheus_labels(scope=name)}}} "
+                        f"{counters[key]}"
+                    )
+        lines.append("# TYPE pystyle_analysis_seconds gauge")
+        for analysis in self.analyses[:slowest]:
+            labels = prometheus_labels(repo=analysis["repo"], commit=analysis["commit"])
+            lines.append(f"pystyle_analysis_seconds{{{labels}}} {analysis['seconds']}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+"""Crawl, clone and analyze in a single run: each repo is analyzed as
+soon as its clone or pull is done, while others are still being
+fetched, instead of waiting for the whole crawl to finish.
+"""
+
+import argparse
+import functools
+import logging
+import multiprocessing.pool
+import os
+import queue
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Set, TypeVar, Union
+
+from pystyle import __version__
+from pystyle.crawl import (
+    CloneScheduler,
+    Fetcher,
+    ResolvedProjects,
+    add_crawl_arguments,
+    clone_arguments,
+    crawl_pypi,
+    crawl_pypi_projects,
+    crawl_pythonwheels,
+    local_clone_path,
+)
+from pystyle.schedule import Failure
+from pystyle.store import StatsJSONL, drop_partial_line, read_jsonl
+from pystyle.update import (
+    Options,
+    add_analysis_arguments,
+    collect_styles,
+    failures_path,
+    flatten_histories,
+    infer_style,
+    infer_style_history,
+    options_from_args,
+    within_limits,
+    worker_pool,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line parameters
+    """
+    parser = argparse.ArgumentParser(
+        description="Crawl Python repositories and infer their style as soon as "
+        "they are cloned."
+    )
+    parser.add_argument(
+        "--version", action="version", version="pystyle {ver}".format(ver=__version__)
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        default=0,
+        help="Verbose mode (-vv for more, -vvv, …)",
+        action="count",
+    )
+    add_crawl_arguments(parser, clone_jobs=("--clone-jobs",))
+    parser.add_argument(
+        "--queue-size",
+        metavar="N",
+        help="Maximum number of cloned repos waiting for analysis, clones pause "
+        "when reached (default: twice the number of analysis workers)",
+        type=int,
+    )
+    parser.add_argument(
+        "--resume",
+        help="Skip repos already present in the .jsonl file left by a previous run",
+        action="store_true",
+    )
+    add_analysis_arguments(parser)
+    parser.add_argument(
+        "git_store",
+        metavar="./git-clones/",
+        help="Directory where git clones are stored.",
+    )
+    parser.add_argument(
+        "stats_csv", metavar="./stats.csv", help="Where to put the stats."
+    )
+    return parser.parse_args()
+
+
+def crawl_into(repos: "queue.Queue[Optional[Path]]", args: argparse.Namespace) -> None:
+    """Crawl and clone as asked on the command line, putting each repo
+    in the queue once cloned, updated or found unchanged, and None once
+    all clones are done.
+
+    Putting a repo blocks while the queue is full, pausing the clones
+    until analyses catch up.
+    """
+    queued: Set[Path] = set()
+    lock = threading.Lock()
+
+    def cloned(github_project_url: str, outcome: str) -> None:
+        if outcome == "failed":
+            return
+        path = Path(local_clone_path(github_project_url, args.git_store))
+        with lock:
+            if path in queued:
+                return
+            queued.add(path)
+        repos.put(path)
+
+    fetcher = Fetcher(args.concurrency, args.rate)
+    resolved = ResolvedProjects(
+        args.resolved or Path(args.git_store) / ".pypi-resolved.json"
+    )
+    try:
+        with CloneScheduler(
+            args.clone_jobs,
+            args.per_host,
+            args.retries,
+            clone_args=clone_arguments(args.blobless, args.depth),
+            on_done=cloned,
+        ) as scheduler:
+            if args.repository:
+                scheduler.submit(args.repository, args.git_store)
+            else:
+                if args.pypi_project:
+                    pypi_project_urls: Iterable[str] = [args.pypi_project]
+                elif args.top360:
+                    pypi_project_urls = crawl_pythonwheels(
+                        fetcher, args.pypi_url, args.pythonwheels_url
+                    )
+                else:
+                    pypi_project_urls = crawl_pypi(fetcher, args.pypi_url)
+                crawl_pypi_projects(
+                    args.git_store, pypi_project_urls, fetcher, resolved, scheduler
+                )
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Crawl failed")
+    finally:
+        repos.put(None)
+
+
+def acquired(items: Iterable[T], slots: threading.Semaphore) -> Iterator[T]:
+    """Take a slot before giving each item.
+    """
+    for item in items:
+        slots.acquire()
+        yield item
+
+
+def released(items: Iterable[T], slots: threading.Semaphore) -> Iterator[T]:
+    """Give a slot back for each item.
+    """
+    for item in items:
+        slots.release()
+        yield item
+
+
+def analyze_as_cloned(
+    pool: multiprocessing.pool.Pool,
+    repos: "queue.Queue[Optional[Path]]",
+    git_store: Path,
+    stats_csv: Path,
+    options: Options,
+    queue_size: int,
+    resume: bool = False,
+) -> None:
+    """Infer the style of repos as they come out of the queue, until
+    None, appending stats to a JSON lines file next to the CSV file as
+    soon as each repo is done, then build the CSV file.
+
+    At most queue_size repos are handed to the pool at once, so a slow
+    analysis stage holds the clones back instead of piling repos up.
+    """
+    failures_jsonl = failures_path(stats_csv)
+    if resume:
+        drop_partial_line(failures_jsonl)
+    with StatsJSONL(stats_csv.with_suffix(".jsonl"), resume) as writer, open(
+        failures_jsonl, "a" if resume else "w"
+    ) as failures_file:
+        done: Set[str] = set()
+        if resume:
+            done = writer.repos() | {
+                failure["repo"] for failure in read_jsonl(failures_jsonl)
+            }
+        slots = threading.BoundedSemaphore(queue_size)
+        to_analyze = acquired(
+            (
+                repo
+                for repo in iter(repos.get, None)
+                if str(repo.relative_to(git_store)) not in done
+            ),
+            slots,
+        )
+        results: Iterable[Union[Optional[Dict[str, Union[str, int]]], Failure]]
+        if options.history:
+            results = flatten_histories(
+                released(
+                    pool.imap_unordered(
+                        functools.partial(
+                            within_limits, infer_style_history, options=options
+                        ),
+                        to_analyze,
+                    ),
+                    slots,
+                )
+            )
+        else:
+            results = released(
+                pool.imap_unordered(
+                    functools.partial(within_limits, infer_style, options=options),
+                    to_analyze,
+                ),
+                slots,
+            )
+        for style in collect_styles(results, git_store, failures_file):
+            writer.write(style)
+        writer.done()
+        writer.export_csv(stats_csv)
+
+
+def main() -> None:
+    """Main entry point allowing external calls
+    """
+    args = parse_args()
+    os.environ["GIT_ASKPASS"] = "/bin/true"
+    logging.basicConfig(
+        level=50 - (args.loglevel * 10),
+        stream=sys.stdout,
+        format="[%(asctime)s] %(levelname)s:%(name)s:%(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    options = options_from_args(args)
+    queue_size = args.queue_size or 2 * (args.jobs or os.cpu_count() or 1)
+    repos: "queue.Queue[Optional[Path]]" = queue.Queue(maxsize=queue_size)
+    crawler = threading.Thread(target=crawl_into, args=(repos, args), daemon=True)
+    # Workers, including those the pool starts to replace dead ones
+    # while the crawl runs, are forked by a single threaded server, so
+    # they never inherit locks held by the crawler threads.
+    multiprocessing.set_forkserver_preload(["pystyle.update"])
+    with worker_pool(options, "forkserver") as pool:
+        crawler.start()
+        analyze_as_cloned(
+            pool,
+            repos,
+            Path(args.git_store),
+            Path(args.stats_csv),
+            options,
+            queue_size,
+            args.resume,
+        )
+    crawler.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Find the requirements of a Python project, statically: packaging
+files are parsed, never executed.
+"""
+
+import ast
+import configparser
+import fnmatch
+import logging
+import re
+from pathlib import PurePosixPath
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+REQUIREMENT = re.compile(
+    r"([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*"
+    r"(\(?\s*(?:[<>=!~][^;@#]*)?)\s*(?:[;@#].*)?"
+)
+
+
+def normalize(requirement: Any) -> Optional[str]:
+    """Give a PEP 508 requirement as its name followed by its version
+    specifiers, dropping extras, environment markers and URLs.
+    """
+    if not isinstance(requirement, str):
+        return None
+    match = REQUIREMENT.fullmatch(requirement.strip())
+    if not match:
+        return None
+    name, specifiers = match.groups()
+    return name + re.sub(r"[\s()]", "", specifiers)
+
+
+def from_requirements_txt(text: str) -> List[str]:
+    """Requirements of a pip requirements file, ignoring options,
+    editable installs and includes of other files.
+    """
+    requirements = []
+    for line in text.replace("\\\n", "").splitlines():
+        line = re.sub(r"(^|\s)#.*", "", line)
+        line = re.sub(r"\s--?[a-z].*", "", line).strip()
+        if not line or line.startswith("-"):
+            continue
+        requirement = normalize(line)
+        if requirement:
+            requirements.append(requirement)
+    return requirements
+
+
+def from_table(table: Mapping[str, Any]) -> List[str]:
+    """Requirements given as a name → version table, as in Pipfiles
+    or the dependencies of Poetry.
+    """
+    requirements = []
+    for name, spec in table.items():
+        if name.lower() == "python":
+            continue
+        version = spec if isinstance(spec, str) else ""
+        if isinstance(spec, dict):
+            version = spec.get("version", "")
+        if not isinstance(version, str) or version == "*":
+            version = ""
+        requirement = normalize(name + version) or normalize(name)
+        if requirement:
+            requirements.append(requirement)
+    return requirements
+
+
+def call_name(function: ast.expr) -> str:
+    """Name of a called function, as in `setup` or `setuptools.setup`.
+    """
+    if isinstance(function, ast.Name):
+        return function.id
+    if isinstance(function, ast.Attribute):
+        return function.attr
+    return ""
+
+
+def from_setup_py(text: str) -> List[str]:
+    """The install_requires of a setup.py, if given as a literal, or
+    as a name bound to a literal at module level.
+    """
+    tree = ast.parse(text)
+    assignments = {
+        target.id: node.value
+        for node in tree.body
+        if isinstance(node, ast.Assign)
+        for target in node.targets
+        if isinstance(target, ast.Name)
+    }
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call) or call_name(node.func) != "setup":
+            continue
+        for keyword in node.keywords:
+            if keyword.arg != "install_requires":
+                continue
+            value = keyword.value
+            if isinstance(value, ast.Name):
+                value = assignments.get(value.id, value)
+            try:
+                install_requires = ast.literal_eval(value)
+            except ValueError:
+                return []
+            if isinstance(install_requires, str):
+                return from_requirements_txt(install_requires)
+            if not isinstance(install_requires, (list, tuple)):
+                return []
+            return [
+                requirement
+                for requirement in map(normalize, install_requires)
+                if requirement
+            ]
+    return []
+
+
+def from_setup_cfg(text: str) -> List[str]:
+    """The install_requires of the [options] section of a setup.cfg.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_string(text)
+    return from_requirements_txt(config.get("options", "install_requires", fallback=""))
+
+
+def load_toml(text: str) -> Dict[str, Any]:
+    """Parse a TOML document.
+    """
+    try:
+        import tomllib
+    except ImportError:  # Before Python 3.11
+        import tomli as tomllib  # type: ignore
+    return tomllib.loads(text)
+
+
+def from_pyproject_toml(text: str) -> List[str]:
+    """The PEP 621 dependencies of a pyproject.toml, or its Poetry
+    dependencies.
+    """
+    pyproject = load_toml(text)
+    requirements = [
+        requirement
+        for requirement in map(
+            normalize, pyproject.get("project", {}).get("dependencies", [])
+        )
+        if requirement
+    ]
+    poetry = pyproject.get("tool", {}).get("poetry", {})
+    return requirements + from_table(poetry.get("dependencies", {}))
+
+
+def from_pipfile(text: str) -> List[str]:
+    """The packages of a Pipfile.
+    """
+    return from_table(load_toml(text).get("packages", {}))
+
+
+PARSERS: Dict[str, Callable[[str], List[str]]] = {
+    "setup.py": from_setup_py,
+    "setup.cfg": from_setup_cfg,
+    "pyproject.toml": from_pyproject_toml,
+    "Pipfile": from_pipfile,
+    "requirements.txt": from_requirements_txt,
+}
+
+
+def requirements_format(path: PurePosixPath) -> Optional[str]:
+    """Tell how to read the requirements from the given file, as a key
+    of PARSERS, or None if it does not give requirements.
+    """
+    if len(path.parts) == 1:
+        if path.name in PARSERS:
+            return path.name
+        if fnmatch.fnmatch(path.name, "requirements*.txt"):
+            return "requirements.txt"
+    elif len(path.parts) == 2 and path.parts[0] == "requirements":
+        if path.suffix == ".txt":
+            return "requirements.txt"
+    return None
+
+
+def find_requirements(file_format: str, data: bytes) -> List[str]:
+    """Read the requirements from the content of a file of the given
+    format, giving none for files that can't be parsed.
+    """
+    try:
+        return PARSERS[file_format](data.decode())
+    except (
+        AttributeError,
+        SyntaxError,
+        TypeError,
+        ValueError,
+        UnicodeDecodeError,
+        RecursionError,
+        configparser.Error,
+    ) as error:
+        logger.debug("Can't read requirements from %s: %s", file_format, error)
+        return []
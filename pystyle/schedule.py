@@ -0,0 +1,107 @@
+"""Scheduling of analyses over a pool of workers: biggest repos first,
+so they don't start last and hold up the end of a run, and limits on
+the time and memory each analysis can take.
+"""
+
+import contextlib
+import logging
+import multiprocessing.pool
+import resource
+import signal
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class TaskTimeout(BaseException):
+    """Raised in a worker when an analysis takes too long.
+
+    Not an Exception, so the analyzers' broad except clauses let it go.
+    """
+
+
+class Failure(NamedTuple):
+    """An analysis given up because it hit a limit.
+    """
+
+    repo: str
+    commit: Optional[str]
+    reason: str
+
+
+def repo_size(repo_path: Path) -> int:
+    """Estimate the size of a repo from its object store, in bytes,
+    without reading any object.
+    """
+    try:
+        count_objects = subprocess.check_output(
+            ("git", "-C", str(repo_path), "count-objects", "-v"),
+            universal_newlines=True,
+            stderr=subprocess.DEVNULL,
+        )
+    except subprocess.CalledProcessError:
+        return 0
+    sizes = dict(line.split(": ", 1) for line in count_objects.splitlines())
+    return (int(sizes.get("size", 0)) + int(sizes.get("size-pack", 0))) * 1024
+
+
+def largest_first(pool: multiprocessing.pool.Pool, repos: Sequence[Path]) -> List[Path]:
+    """Sort repos by decreasing estimated size, estimating them in the
+    pool.
+    """
+    sizes: Dict[Path, int] = dict(zip(repos, pool.imap(repo_size, repos, chunksize=16)))
+    return sorted(repos, key=sizes.__getitem__, reverse=True)
+
+
+def raise_timeout(signum, frame):
+    """SIGALRM handler giving up the running analysis.
+    """
+    raise TaskTimeout
+
+
+@contextlib.contextmanager
+def time_limit(seconds: Optional[float]) -> Iterator[None]:
+    """Raise TaskTimeout in the block if it runs for more than the given
+    seconds.
+
+    Subprocesses are not tracked here: TaskTimeout interrupts the wait
+    for the running one, and it's up to the code starting processes to
+    kill them on errors. subprocess.run and the functions built on it
+    do, as do CatFile and the rev-list stream of pick_random_commits.
+
+    Errors raised past the deadline, typically while cleaning up after
+    the timeout, are reported as the timeout itself.
+    """
+    if not seconds:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    previous_handler = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    except Exception as error:
+        if time.monotonic() >= deadline:
+            raise TaskTimeout from error
+        raise
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def limit_memory(megabytes: Optional[int]) -> None:
+    """Pool initializer limiting the heap of a worker, and of the git
+    processes it spawns, so a runaway analysis gets a MemoryError
+    instead of taking the machine down.
+
+    Memory mapped files, like git packs, don't count.
+    """
+    if megabytes:
+        _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        soft = megabytes * 1024 * 1024
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_DATA, (soft, hard))
@@ -0,0 +1,242 @@
+"""Stats of all analyzed commits, appended to a JSON lines file, or
+stored in SQLite with a row per metric, so updating a few metrics
+doesn't mean rewriting everything.
+"""
+
+import csv
+import itertools
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Set
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats (
+    repo TEXT NOT NULL,
+    "commit" TEXT NOT NULL,
+    date TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value,
+    PRIMARY KEY (repo, "commit", metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS stats_date ON stats (date);
+CREATE TABLE IF NOT EXISTS metrics (metric TEXT PRIMARY KEY);
+"""
+
+KEYS = ("commit", "repo", "date")
+
+
+class StatsWriter:
+    """Where the stats of analyzed commits are written, as soon as each
+    repo is done, so a crashed run can be resumed.
+    """
+
+    def __enter__(self) -> "StatsWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        """Release the underlying file or connection.
+        """
+        raise NotImplementedError
+
+    def repos(self) -> Set[str]:
+        """Repos having stats for at least a commit.
+        """
+        raise NotImplementedError
+
+    def write(self, style: Mapping[str, Any]) -> None:
+        """Store the stats of a commit.
+        """
+        raise NotImplementedError
+
+    def done(self) -> None:
+        """Called once all stats are written, before reading them back.
+        """
+
+    def styles(self) -> Iterator[Dict[str, Any]]:
+        """Stats of each commit.
+        """
+        raise NotImplementedError
+
+    def export_csv(self, stats_csv: Path) -> None:
+        """Write the stats of all commits as a wide CSV file, a commit
+        per line and a metric per column.
+        """
+        raise NotImplementedError
+
+
+def read_jsonl(stats_jsonl: Path) -> Iterator[Dict[str, Any]]:
+    """Read back the stats of a JSON lines file.
+    """
+    with open(stats_jsonl) as jsonl_file:
+        for line in jsonl_file:
+            yield json.loads(line)
+
+
+def drop_partial_line(jsonl_path: Path, block_size: int = 8192) -> None:
+    """Truncate a JSON lines file after its last newline, dropping the
+    line a killed run may have left half written, so it can be read
+    back and appended to.
+    """
+    try:
+        jsonl_file = open(jsonl_path, "rb+")
+    except FileNotFoundError:
+        return
+    with jsonl_file:
+        end = jsonl_file.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - block_size)
+            jsonl_file.seek(start)
+            newline = jsonl_file.read(end - start).rfind(b"\n")
+            if newline != -1:
+                jsonl_file.truncate(start + newline + 1)
+                return
+            end = start
+        jsonl_file.truncate(0)
+
+
+class StatsJSONL(StatsWriter):
+    """Stats appended to a JSON lines file, a commit per line, appending
+    to the stats of a previous run on resume.
+    """
+
+    def __init__(self, path: Path, resume: bool = False) -> None:
+        self.path = path
+        if resume:
+            drop_partial_line(path)
+        self.jsonl_file = open(path, "a" if resume else "w")
+
+    def close(self) -> None:
+        self.jsonl_file.close()
+
+    def repos(self) -> Set[str]:
+        return {style["repo"] for style in read_jsonl(self.path)}
+
+    def write(self, style: Mapping[str, Any]) -> None:
+        self.jsonl_file.write(json.dumps(style) + "\n")
+        self.jsonl_file.flush()
+
+    def done(self) -> None:
+        self.jsonl_file.close()
+
+    def styles(self) -> Iterator[Dict[str, Any]]:
+        return read_jsonl(self.path)
+
+    def export_csv(self, stats_csv: Path) -> None:
+        """Build the CSV file in two passes, so only the header is kept
+        in memory.
+        """
+        headers: Dict[str, None] = {}
+        for style in self.styles():
+            headers.update(dict.fromkeys(style))
+        with open(stats_csv, "w") as csv_file:
+            writer = csv.DictWriter(
+                csv_file, fieldnames=list(headers), dialect=csv.unix_dialect
+            )
+            writer.writeheader()
+            writer.writerows(self.styles())
+
+
+class StatsStore(StatsWriter):
+    """SQLite backed store of (repo, commit, date, metric, value).
+
+    Stats of a commit are upserted metric by metric, and read back as
+    the same dicts as the ones stored, one per commit.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(str(path), timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> "StatsStore":
+        return self
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def write(self, style: Mapping[str, Any], dropped: Iterable[str] = ()) -> None:
+        """Insert or update the stats of a commit, deleting the dropped
+        metrics, those an updated analyzer no longer gives.
+        """
+        metrics = [(key, value) for key, value in style.items() if key not in KEYS]
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM stats WHERE repo = ? AND "commit" = ? AND metric = ?',
+                ((style["repo"], style["commit"], metric) for metric in dropped),
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO metrics VALUES (?)",
+                ((metric,) for metric, _ in metrics),
+            )
+            self.connection.executemany(
+                "INSERT INTO stats VALUES (?, ?, ?, ?, ?) "
+                'ON CONFLICT (repo, "commit", metric) '
+                "DO UPDATE SET date = excluded.date, value = excluded.value",
+                (
+                    (style["repo"], style["commit"], style["date"], metric, value)
+                    for metric, value in metrics
+                ),
+            )
+
+    def metrics(self) -> List[str]:
+        """All metrics ever stored, in the order they first appeared.
+        """
+        return [
+            metric
+            for metric, in self.connection.execute(
+                "SELECT metric FROM metrics ORDER BY rowid"
+            )
+        ]
+
+    def repos(self) -> Set[str]:
+        return {
+            repo for repo, in self.connection.execute("SELECT DISTINCT repo FROM stats")
+        }
+
+    def styles(
+        self,
+        repo: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Stats of each commit, optionally only those of a repo, or
+        of commits dated in [since, until).
+        """
+        conditions = []
+        parameters = []
+        if repo is not None:
+            conditions.append("repo = ?")
+            parameters.append(repo)
+        if since is not None:
+            conditions.append("date >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("date < ?")
+            parameters.append(until)
+        query = 'SELECT repo, "commit", date, metric, value FROM stats'
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += ' ORDER BY repo, "commit"'
+        rows = self.connection.execute(query, parameters)
+        for (repo, commit, date), metrics in itertools.groupby(
+            rows, key=lambda row: row[:3]
+        ):
+            style = {metric: value for *_, metric, value in metrics}
+            style.update({"commit": commit, "repo": repo, "date": date})
+            yield style
+
+    def export_csv(self, stats_csv: Path) -> None:
+        with open(stats_csv, "w") as csv_file:
+            writer = csv.DictWriter(
+                csv_file,
+                fieldnames=self.metrics() + list(KEYS),
+                dialect=csv.unix_dialect,
+            )
+            writer.writeheader()
+            writer.writerows(self.styles())
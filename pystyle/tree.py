@@ -0,0 +1,364 @@
+"""Snapshots of the files of a repository, either checked out on disk
+or read straight from the git object database.
+"""
+
+import io
+import itertools
+import logging
+import os
+import shutil
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+from typing import IO, BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+from pystyle import metrics
+
+logger = logging.getLogger(__name__)
+
+
+REGULAR_FILE_MODES = ("100644", "100755")
+
+
+class Tree:
+    """Base class for a snapshot of the files of a repository.
+
+    All paths are relative to the root of the repository.
+    """
+
+    def files(self) -> Iterator[PurePosixPath]:
+        """Yield all regular files of the snapshot.
+        """
+        raise NotImplementedError
+
+    def open(self, path: PurePosixPath) -> BinaryIO:
+        """Open a file of the snapshot for reading, in binary mode.
+        """
+        raise NotImplementedError
+
+    def is_file(self, path: PurePosixPath) -> bool:
+        """Tell if the given path is a file of the snapshot.
+        """
+        raise NotImplementedError
+
+    def is_dir(self, path: PurePosixPath) -> bool:
+        """Tell if the given path is a directory of the snapshot.
+        """
+        raise NotImplementedError
+
+    def blob_id(self, path: PurePosixPath) -> Optional[str]:
+        """Get the git blob SHA of a file of the snapshot, or None if unknown.
+        """
+        raise NotImplementedError
+
+    def read_bytes(self, path: PurePosixPath) -> bytes:
+        """Get the content of a file of the snapshot.
+        """
+        with self.open(path) as opened_file:
+            return opened_file.read()
+
+    def read_text(self, path: PurePosixPath) -> str:
+        """Get the content of a file of the snapshot, decoded.
+        """
+        return self.read_bytes(path).decode()
+
+
+class WorkTree(Tree):
+    """Files as currently checked out on disk.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.index: Optional[Dict[PurePosixPath, Tuple[str, str]]] = None
+        self.is_git = True
+
+    def __repr__(self):
+        return f"WorkTree({str(self.root)!r})"
+
+    def read_index(self) -> Dict[PurePosixPath, Tuple[str, str]]:
+        """Get the mode and blob SHA of each file of the git index,
+        empty if the tree is not a git repository.
+        """
+        if self.index is None:
+            self.index = {}
+            try:
+                ls_files = subprocess.check_output(
+                    ("git", "-C", str(self.root), "ls-files", "-s", "-z"),
+                    stderr=subprocess.DEVNULL,
+                )
+            except subprocess.CalledProcessError:
+                self.is_git = False
+                ls_files = b""
+            for entry in ls_files.split(b"\0"):
+                if entry:
+                    info, name = entry.split(b"\t", 1)
+                    mode, sha, _ = info.decode().split()
+                    self.index[PurePosixPath(os.fsdecode(name))] = (mode, sha)
+        return self.index
+
+    def files(self) -> Iterator[PurePosixPath]:
+        """Yield the regular files tracked by git, so untracked files
+        (virtualenvs, build artifacts, ...) are never walked.
+
+        Only when git can't list them, outside of a git repository, yield
+        all files of the hierarchy, not descending into .git directories.
+        """
+        index = self.read_index()
+        if self.is_git:
+            for path, (mode, _) in index.items():
+                if mode in REGULAR_FILE_MODES:
+                    yield path
+            return
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [dirname for dirname in dirnames if dirname != ".git"]
+            relative_dir = PurePosixPath(
+                Path(dirpath).relative_to(self.root).as_posix()
+            )
+            for filename in filenames:
+                yield relative_dir / filename
+
+    def open(self, path: PurePosixPath) -> BinaryIO:
+        return open(self.root / path, "rb")
+
+    def blob_id(self, path: PurePosixPath) -> Optional[str]:
+        """Get the blob SHA of a file from the git index, assuming the
+        working tree is clean, as after a `git checkout -f`.
+        """
+        try:
+            return self.read_index()[path][1]
+        except KeyError:
+            return None
+
+    def is_file(self, path: PurePosixPath) -> bool:
+        return (self.root / path).is_file()
+
+    def is_dir(self, path: PurePosixPath) -> bool:
+        return (self.root / path).is_dir()
+
+
+class CatFile:
+    """Context manager around a long-lived `git cat-file --batch`
+    process, to read many objects of a repository without spawning a
+    process per object.
+
+    The process is killed if the block raises, and stopped by closing
+    its input otherwise.
+    """
+
+    def __init__(self, repo_path: Path) -> None:
+        self.repo_path = repo_path
+        self.process = subprocess.Popen(
+            ("git", "-C", str(repo_path), "cat-file", "--batch"),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        stdin, stdout = self.process.stdin, self.process.stdout
+        assert stdin is not None and stdout is not None  # Both are pipes.
+        self.stdin: IO[bytes] = stdin
+        self.stdout: IO[bytes] = stdout
+
+    def __enter__(self) -> "CatFile":
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is not None:
+            # Like subprocess.run, don't wait for a process that may be
+            # stuck, as on a timeout while it fetches a missing blob.
+            self.process.kill()
+        self.stdin.close()
+        self.stdout.close()
+        self.process.wait()
+
+    def read(self, object_name: str) -> bytes:
+        """Get the content of an object, by name or SHA.
+        """
+        self.stdin.write(object_name.encode() + b"\n")
+        self.stdin.flush()
+        header = self.stdout.readline()
+        if header.endswith(b" missing\n"):
+            raise FileNotFoundError(object_name)
+        size = int(header.split()[2])
+        return self.stdout.read(size + 1)[:-1]
+
+
+def promisor_remote(repo_path: Path) -> Optional[str]:
+    """Name of the remote lazily providing the missing objects of a
+    partial clone, or None for a full clone.
+    """
+    try:
+        promisors = subprocess.check_output(
+            (
+                "git",
+                "-C",
+                str(repo_path),
+                "config",
+                "--get-regexp",
+                r"^remote\..*\.promisor$",
+            ),
+            universal_newlines=True,
+        )
+    except subprocess.CalledProcessError:
+        return None
+    for promisor in promisors.splitlines():
+        key, value = promisor.split(" ", 1)
+        if value == "true":
+            return key.partition(".")[2].rpartition(".")[0]
+    return None
+
+
+def fetch_missing_blobs(repo_path: Path, commit: str) -> None:
+    """In a partial clone, fetch all the missing blobs of a commit in a
+    single request, instead of letting git fetch them one by one.
+    """
+    remote = promisor_remote(repo_path)
+    if remote is None:
+        return
+    rev_list = subprocess.check_output(
+        ("git", "-C", str(repo_path), "rev-list", "--objects", "--missing=print")
+        + ("--no-walk", commit),
+        universal_newlines=True,
+    )
+    missing = [line[1:] for line in rev_list.splitlines() if line.startswith("?")]
+    if missing:
+        subprocess.run(
+            ("git", "-C", str(repo_path), "-c", "fetch.negotiationAlgorithm=noop")
+            + ("fetch", "--quiet", "--no-tags", "--no-write-fetch-head")
+            + ("--recurse-submodules=no", "--filter=blob:none", "--stdin", remote),
+            input="\n".join(missing),
+            universal_newlines=True,
+            check=True,
+        )
+
+
+class GitTree(Tree):
+    """Files of a given commit, read from the git object database
+    without touching the working tree.
+
+    In a partial clone, the missing blobs of the commit are fetched first.
+    """
+
+    def __init__(self, repo_path: Path, commit: str, cat_file: CatFile) -> None:
+        self.repo_path = repo_path
+        self.commit = commit
+        self.cat_file = cat_file
+        self.blobs: Dict[PurePosixPath, Tuple[str, str]] = {}
+        self.dirs: Set[PurePosixPath] = set()
+        ls_tree = subprocess.check_output(
+            ("git", "-C", str(repo_path), "ls-tree", "-r", "-z", "--full-tree", commit)
+        )
+        for entry in ls_tree.split(b"\0"):
+            if not entry:
+                continue
+            info, name = entry.split(b"\t", 1)
+            mode, object_type, sha = info.decode().split()
+            path = PurePosixPath(os.fsdecode(name))
+            self.dirs.update(path.parents)
+            if object_type == "blob":
+                self.blobs[path] = (mode, sha)
+        self.dirs.discard(PurePosixPath("."))
+        fetch_missing_blobs(repo_path, commit)
+
+    def __repr__(self):
+        return f"GitTree({str(self.repo_path)!r}, {self.commit!r})"
+
+    def files(self) -> Iterator[PurePosixPath]:
+        for path, (mode, _) in self.blobs.items():
+            if mode in REGULAR_FILE_MODES:
+                yield path
+
+    def read_bytes(self, path: PurePosixPath) -> bytes:
+        try:
+            _, sha = self.blobs[path]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+        return self.cat_file.read(sha)
+
+    def open(self, path: PurePosixPath) -> BinaryIO:
+        return io.BytesIO(self.read_bytes(path))
+
+    def blob_id(self, path: PurePosixPath) -> Optional[str]:
+        try:
+            return self.blobs[path][1]
+        except KeyError:
+            return None
+
+    def is_file(self, path: PurePosixPath) -> bool:
+        return path in self.blobs
+
+    def is_dir(self, path: PurePosixPath) -> bool:
+        return path in self.dirs
+
+
+IDLE_WORKTREES: Dict[Path, List[Path]] = {}
+WORKTREE_NUMBERS = itertools.count()
+
+
+def worktrees_dir(repo_path: Path) -> Path:
+    """Where pystyle keeps the worktrees of a repository.
+    """
+    return repo_path / ".git" / "pystyle-worktrees"
+
+
+@contextmanager
+def worktree(repo_path: Path, commit: str) -> Iterator[Path]:
+    """Context manager checking out a commit in a detached git worktree,
+    so many commits of a same repo can be analyzed at once.
+
+    Worktrees are owned by the current process, and reused by its next
+    tasks on the same repo, so switching commits only rewrites the files
+    that differ.
+    """
+    idle = IDLE_WORKTREES.setdefault(repo_path, [])
+    while idle and not idle[-1].is_dir():
+        idle.pop()  # Removed by remove_worktrees.
+    with metrics.scope("checkout"):
+        path = checkout_worktree(repo_path, commit, idle)
+    try:
+        yield path
+    finally:
+        idle.append(path)
+
+
+def checkout_worktree(repo_path: Path, commit: str, idle: List[Path]) -> Path:
+    """Checkout a commit in an idle worktree of the repo, or in a new one.
+    """
+    if idle:
+        path = idle.pop()
+        subprocess.check_call(
+            ("git", "-C", str(path), "checkout", "-f", "--detach", commit),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    else:
+        path = worktrees_dir(repo_path) / f"{os.getpid()}-{next(WORKTREE_NUMBERS)}"
+        while path.exists():  # Left by a crashed run.
+            path = worktrees_dir(repo_path) / f"{os.getpid()}-{next(WORKTREE_NUMBERS)}"
+        subprocess.check_call(
+            ("git", "-C", str(repo_path), "worktree", "add", "-f", "--detach")
+            + (str(path), commit),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    return path
+
+
+def remove_worktrees(repo_path: Path) -> None:
+    """Remove the worktrees created for a repository by all processes.
+
+    Failing to prune them only leaves stale entries in the repository,
+    so it's logged instead of aborting the run.
+    """
+    directory = worktrees_dir(repo_path)
+    if not directory.is_dir():
+        return
+    for path in directory.iterdir():
+        subprocess.run(
+            ("git", "-C", str(repo_path), "worktree", "remove", "--force", str(path)),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    shutil.rmtree(directory, ignore_errors=True)
+    try:
+        subprocess.run(("git", "-C", str(repo_path), "worktree", "prune"), check=True)
+    except subprocess.CalledProcessError as error:
+        logger.error("Can't prune worktrees of %r: %s", repo_path, error)
@@ -5,25 +5,153 @@
 
 import argparse
 import csv
+import functools
+import importlib.util
+import io
 import json
 import logging
+import multiprocessing.pool
 import os
 import random
 import re
 import subprocess
 import sys
+import threading
+import tokenize
 from collections import Counter
-from multiprocessing import Pool
-from pathlib import Path
-from typing import Callable, Dict, Mapping, Optional, TypeVar, Union
+from pathlib import Path, PurePosixPath
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    TextIO,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 import licensename
+import pycodestyle
 
-from pystyle import __version__
+from pystyle import __version__, metrics
+from pystyle.cache import DEFAULT_CACHE_SIZE, BlobCache, open_cache
+from pystyle.licenses import COMMON_LICENSES, license_fingerprint
+from pystyle.requirements import find_requirements, requirements_format
+from pystyle.schedule import (
+    Failure,
+    TaskTimeout,
+    largest_first,
+    limit_memory,
+    time_limit,
+)
+from pystyle.metrics import MetricsReport, recording
+from pystyle.store import (
+    StatsJSONL,
+    StatsStore,
+    StatsWriter,
+    drop_partial_line,
+    read_jsonl,
+)
+from pystyle.tree import CatFile, GitTree, Tree, WorkTree, remove_worktrees, worktree
+from pystyle.walk import DEFAULT_PRUNE, Access, FileVisitor, Tally, walk
 
 logger = logging.getLogger(__name__)
 
 
+def add_analysis_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of the analyses, shared by pystyle-update and
+    pystyle-pipeline, read back by options_from_args.
+    """
+    parser.add_argument("--only", help="Only run analyzers matching the given pattern")
+    parser.add_argument(
+        "--no-checkout",
+        help="Read commits from the git object database instead of checking them out",
+        dest="checkout",
+        action="store_false",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of analysis worker processes (default: one per CPU)",
+        type=int,
+    )
+    parser.add_argument(
+        "--timeout",
+        metavar="SECONDS",
+        help="Give up analyzing a repo, or a commit, after the given time, "
+        "recording it in the -failures.jsonl file next to the stats CSV file",
+        type=float,
+    )
+    parser.add_argument(
+        "--memory-limit",
+        metavar="MB",
+        help="Maximum heap size of each worker and of the git processes it runs, "
+        "analyses running out of memory are recorded like timeouts, as memory "
+        "failures, or as errors when it's a git process that ran out",
+        type=int,
+    )
+    parser.add_argument(
+        "--history",
+        metavar="K",
+        help="Analyze K commits per repo, evenly spread over its history, "
+        "reading only files changed between them (implies --no-checkout)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed used to pick random commits, so a run can be reproduced",
+        type=int,
+    )
+    parser.add_argument(
+        "--prune",
+        metavar="PATTERNS",
+        help="Comma separated glob patterns of directories not to walk, "
+        "like bundled virtualenvs or vendored projects (default: %(default)s)",
+        default=",".join(DEFAULT_PRUNE),
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="./cache.sqlite",
+        help="Cache facts about already seen git blobs in the given file",
+        type=Path,
+    )
+    parser.add_argument(
+        "--cache-size",
+        metavar="MB",
+        help="Maximum size of the cache, in megabytes (default: %(default)s)",
+        type=int,
+        default=DEFAULT_CACHE_SIZE // 1024 // 1024,
+    )
+
+
+def options_from_args(args: argparse.Namespace) -> "Options":
+    """Options of the analyses given on the command line, as added by
+    add_analysis_arguments.
+    """
+    return Options(
+        only=args.only,
+        checkout=args.checkout,
+        cache=args.cache,
+        cache_size=args.cache_size * 1024 * 1024,
+        history=args.history,
+        seed=args.seed,
+        prune=tuple(pattern for pattern in args.prune.split(",") if pattern),
+        jobs=args.jobs,
+        timeout=args.timeout,
+        memory_limit=args.memory_limit,
+    )
+
+
 def parse_args() -> argparse.Namespace:
     """Parse command line parameters
     """
@@ -46,7 +174,50 @@ def parse_args() -> argparse.Namespace:
         help="Do not search for new commits but update an existing stats file",
         action="store_true",
     )
-    parser.add_argument("--only", help="Only run updates matching the given pattern")
+    parser.add_argument(
+        "--resume",
+        help="Skip repos already present in the .jsonl file left by a previous run, "
+        "or in the stats store",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--store",
+        metavar="./stats.db",
+        help="Keep stats in the given SQLite database, upserting them as they are "
+        "computed or updated, and export it to the stats CSV file",
+        type=Path,
+    )
+    parser.add_argument(
+        "--commits",
+        help="Number of random commits analyzed per repo, in parallel "
+        "(default: %(default)s)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--columnar",
+        metavar="./stats.parquet",
+        help="Also export stats to the given Parquet file, "
+        "or Arrow IPC file if named *.arrow or *.feather",
+        type=Path,
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="./metrics.json",
+        help="Record wall time, I/O and subprocesses by analyzer and by repo, "
+        "and write them to the given JSON file, or Prometheus text file if "
+        "named *.prom",
+        type=Path,
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="N",
+        help="Profile each analysis with cProfile, keeping the dumps of the N "
+        "slowest ones next to the --metrics file",
+        type=int,
+        default=0,
+    )
+    add_analysis_arguments(parser)
     parser.add_argument(
         "git_store",
         metavar="../pystyle-clones/",
@@ -55,53 +226,125 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "stats_csv", metavar="./stats.csv", help="Where to put the stats."
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.columnar and importlib.util.find_spec("pyarrow") is None:
+        parser.error("--columnar needs pyarrow, try: pip install pystyle[columnar]")
+    if args.columnar and args.update and not args.store:
+        parser.error("--columnar can only be used with --update along with --store")
+    if args.profile and not args.metrics:
+        parser.error("--profile needs --metrics")
+    if args.metrics and args.update:
+        parser.error("--metrics can't be used with --update")
+    return args
+
+
+AnalyzerFunction = TypeVar("AnalyzerFunction", bound=Callable)
 
 
-def detect_test_engine(repo_path: Path) -> Dict[str, str]:
+def versioned(version: int) -> Callable[[AnalyzerFunction], AnalyzerFunction]:
+    """Tag an analyzer with a version, to bump each time its output
+    changes so `--update` knows which columns to recompute.
+    """
+
+    def decorator(analyzer: AnalyzerFunction) -> AnalyzerFunction:
+        setattr(analyzer, "version", version)
+        return analyzer
+
+    return decorator
+
+
+TEST_ENGINES = ("nose", "pytest", "unittest")
+TEST_ENGINE_MENTIONS = re.compile(b"|".join(engine.encode() for engine in TEST_ENGINES))
+TEST_ENGINE_IMPORTS = re.compile(
+    rb"^[ \t]*(?:import|from)[ \t]+("
+    + b"|".join(engine.encode() for engine in TEST_ENGINES)
+    + rb")\b",
+    re.M,
+)
+TEST_ENGINE_HINT_FILES = (
+    "README.txt",
+    "README",
+    "README.md",
+    "README.rst",
+    "tox.ini",
+    "setup.cfg",
+    "pytest.ini",
+    "requirements.txt",
+    "requirements-dev.txt",
+    "requirements_dev.txt",
+    "dev-requirements.txt",
+    "requirements-test.txt",
+    "test-requirements.txt",
+    "test_requirements.txt",
+)
+TEST_ENGINE_SCAN_LIMIT = 256 * 1024
+
+
+def find_test_engines(pattern: Pattern[bytes], data: bytes) -> Dict[str, int]:
+    """Find which test engines the pattern matches in the first
+    TEST_ENGINE_SCAN_LIMIT bytes of data, stopping once all are found.
+    """
+    found: Dict[str, int] = {}
+    for match in pattern.finditer(data, 0, TEST_ENGINE_SCAN_LIMIT):
+        found[match.group(match.lastindex or 0).decode()] = 1
+        if len(found) == len(TEST_ENGINES):
+            break
+    return found
+
+
+class TestEngineDetector(FileVisitor):
     """Look for hints about the test engine used by the given repo.
+
+    Each README, tox.ini, setup.cfg, pytest.ini or requirements file
+    mentioning an engine votes for it, as do Python files importing
+    it and conftest.py files for pytest.
     """
-    detected_engines: Counter = Counter()
-    files_to_search = [
-        "README.txt",
-        "README",
-        "README.md",
-        "README.rst",
-        "tox.ini",
-        "requirements.txt",
-        "requirements-dev.txt",
-        "requirements_dev.txt",
-        "dev-requirements.txt",
-        "requirements-test.txt",
-        "test-requirements.txt",
-        "test_requirements.txt",
-    ]
-    known_engines = ["nose", "pytest", "unittest"]
-    for file_to_search in files_to_search:
-        if (repo_path / file_to_search).exists():
-            tox_text = (repo_path / file_to_search).read_text()
-            for engine in known_engines:
-                if engine in tox_text:
-                    detected_engines[engine] += 1
-    try:
-        return {"test_engine": detected_engines.most_common(1)[0][0]}
-    except IndexError:
-        return {"test_engine": ""}
 
+    version = 2
 
-def has_typical_dirs(repo_path: Path) -> Dict[str, int]:
-    """Given a path to a git clone, returns a dict of present/absent
+    def wants(self, path: PurePosixPath) -> bool:
+        return path.suffix == ".py" or str(path) in TEST_ENGINE_HINT_FILES
+
+    def cache_name(self, path: PurePosixPath) -> str:
+        return f"{self.name}:{'imports' if path.suffix == '.py' else 'mentions'}"
+
+    def scan_file(self, path: PurePosixPath, data: bytes) -> Dict[str, int]:
+        if path.suffix != ".py":
+            return find_test_engines(TEST_ENGINE_MENTIONS, data)
+        return {
+            "import:" + engine: 1
+            for engine in find_test_engines(TEST_ENGINE_IMPORTS, data)
+        }
+
+    def tally(self, path: PurePosixPath, facts: Mapping[str, int]) -> Dict[str, int]:
+        if path.name == "conftest.py":
+            return {**facts, "conftest": 1}
+        return dict(facts)
+
+    def summarize(self, totals: Counter) -> Dict[str, Union[int, str]]:
+        votes: Counter = Counter()
+        for engine in TEST_ENGINES:
+            votes[engine] = totals[engine] + int(totals["import:" + engine] > 0)
+        votes["pytest"] += int(totals["conftest"] > 0)
+        engine, count = votes.most_common(1)[0]
+        return {"test_engine": engine if count else ""}
+
+
+@versioned(1)
+def has_typical_dirs(tree: Tree) -> Dict[str, int]:
+    """Given the files of a git clone, returns a dict of present/absent
     directories.
     """
     typical_files = ("doc/", "docs/", "examples/", "src/", "test/", "tests/")
     return {
-        "dir:" + typical_dir: int((repo_path / typical_dir).is_dir())
+        "dir:" + typical_dir: int(tree.is_dir(PurePosixPath(typical_dir)))
         for typical_dir in typical_files
     }
 
 
-def has_typical_files(repo_path: Path) -> Dict[str, int]:
-    """Given a path to a git clone, returns a dict of present/absent files.
+@versioned(1)
+def has_typical_files(tree: Tree) -> Dict[str, int]:
+    """Given the files of a git clone, returns a dict of present/absent files.
     """
     typical_files = (
         ".gitignore",
@@ -133,236 +376,602 @@ def has_typical_files(repo_path: Path) -> Dict[str, int]:
         "tox.ini",
     )
     return {
-        "file:" + typical_file: int((repo_path / typical_file).is_file())
+        "file:" + typical_file: int(tree.is_file(PurePosixPath(typical_file)))
         for typical_file in typical_files
     }
 
 
-def infer_license(repo_path: Path) -> Dict[str, str]:
-    """Given a repository path, try to locate the license and infer it.
+LICENSE_FILES = ("LICENSE", "LICENSE.txt", "LICENCE", "LICENCE.txt")
+
+KNOWN_LICENSE_TEXTS: Dict[str, Optional[str]] = dict(COMMON_LICENSES)
+
+
+class LicenseIdentifier(FileVisitor):
+    """Given the license files of a repository, try to infer its license.
+
+    Results are cached by blob SHA like other visitors, and common
+    license texts, or texts already identified by this process, are
+    recognized by their fingerprint, before calling the slower
+    licensename matcher.
     """
-    probable_license_files = ("LICENSE", "LICENSE.txt", "LICENCE", "LICENCE.txt")
-    for probable_license_file in probable_license_files:
-        license_path = repo_path / probable_license_file
+
+    def wants(self, path: PurePosixPath) -> bool:
+        return str(path) in LICENSE_FILES
+
+    def scan(self, data: bytes) -> Dict[str, int]:
         try:
-            license_name = licensename.from_file(license_path)
-            if license_name is not None:
-                return {"license": license_name}
-            logger.warning("Unknown license for %s", license_path)
+            text = data.decode()
+        except UnicodeDecodeError:
+            return {}
+        fingerprint = license_fingerprint(text)
+        if fingerprint not in KNOWN_LICENSE_TEXTS:
+            KNOWN_LICENSE_TEXTS[fingerprint] = licensename.from_text(text)
+            if KNOWN_LICENSE_TEXTS[fingerprint] is None:
+                logger.warning("Unknown license text (fingerprint %s)", fingerprint)
+        license_name = KNOWN_LICENSE_TEXTS[fingerprint]
+        if license_name is None:
+            return {}
+        return {"license:" + license_name: 1}
 
-        except (FileNotFoundError, UnicodeDecodeError):
-            continue
-    return {"license": ""}
+    def tally(self, path: PurePosixPath, facts: Mapping[str, int]) -> Dict[str, int]:
+        rank = LICENSE_FILES.index(str(path))
+        return {f"{rank}:{key.partition(':')[2]}": 1 for key in facts}
 
+    def summarize(self, totals: Counter) -> Dict[str, Union[int, str]]:
+        if not totals:
+            return {"license": ""}
+        first = min(totals, key=lambda key: int(key.partition(":")[0]))
+        return {"license": first.partition(":")[2]}
 
-def count_lines_of_code(path: Path) -> Dict[str, int]:
+
+class LinesOfCodeCounter(FileVisitor):
     """Basic line-of-code counter in a hierarchy.
+
+    Newlines are counted in the raw bytes, chunk by chunk, skipping
+    files looking binary (having a NUL byte in their first 8000 bytes,
+    like git does).
     """
-    interesting_ones = {
-        "csv",
-        "c",
-        "ipynb",
-        "json",
-        "po",
-        "py",
-        "xml",
-        "yaml",
-        "ini",
-        "toml",
-    }
-    source_files = path.rglob("*.*")
-    lines_counter: Dict[str, int] = Counter()
-    for source_file in source_files:
-        if ".git" in source_file.name:
-            continue
-        try:
-            with open(source_file) as opened_file:
-                suffix = source_file.suffix[1:].lower()
-                if suffix in interesting_ones:
-                    lines_counter["lines_of:" + suffix] += len(opened_file.readlines())
-        except (UnicodeDecodeError, IsADirectoryError, FileNotFoundError, OSError):
-            # We may open issues for broken symlinks þ
-            # Open issue also for symlinks loops?
-            pass
-    return dict(lines_counter)
-
-
-def dunder_future(path: Path) -> Dict[str, int]:
+
+    version = 2
+    access = Access.CHUNKS
+    suffixes = (
+        ".csv",
+        ".c",
+        ".ipynb",
+        ".json",
+        ".po",
+        ".py",
+        ".xml",
+        ".yaml",
+        ".ini",
+        ".toml",
+    )
+
+    def scan(self, data: bytes) -> Dict[str, int]:
+        return self.scan_chunks((data,))
+
+    def scan_chunks(self, chunks: Iterable[bytes]) -> Dict[str, int]:
+        lines = 0
+        head = b""
+        last_chunk = b""
+        for chunk in chunks:
+            if len(head) < 8000:
+                head = (head + chunk[:8000])[:8000]
+                if b"\0" in head:
+                    return {"binary": 1}
+            lines += chunk.count(b"\n")
+            if chunk:
+                last_chunk = chunk
+        if last_chunk and not last_chunk.endswith(b"\n"):
+            lines += 1
+        return {"lines": lines}
+
+    def tally(self, path: PurePosixPath, facts: Mapping[str, int]) -> Dict[str, int]:
+        if "lines" not in facts:
+            return {}
+        return {"lines_of:" + path.suffix[1:].lower(): facts["lines"]}
+
+
+class DunderFutureCounter(FileVisitor):
     """Search for __future__
     """
-    source_files = path.rglob("*.py")
-    total_files = 0
-    dunder_future_found = 0
-    for source_file in source_files:
-        try:
-            with open(source_file) as opened_file:
-                total_files += 1
-                if "from __future__ import" in opened_file.read():
-                    dunder_future_found += 1
-        except (UnicodeDecodeError, IsADirectoryError, FileNotFoundError, OSError):
-            # We may open issues for broken symlinks þ
-            # Open issue also for symlinks loops?
-            pass
-    return {
-        "dunder_future_pct": int(
-            100 * dunder_future_found / total_files if total_files else 0
-        )
-    }
 
+    suffixes = (".py",)
 
-def count_shebangs(path: Path) -> Dict[str, int]:
+    def scan(self, data: bytes) -> Dict[str, int]:
+        return {"files": 1, "dunder_future": int(b"from __future__ import" in data)}
+
+    def summarize(self, totals: Counter) -> Dict[str, Union[int, str]]:
+        return {
+            "dunder_future_pct": int(
+                100 * totals["dunder_future"] / totals["files"]
+                if totals["files"]
+                else 0
+            )
+        }
+
+
+class ShebangCounter(FileVisitor):
     """Cound number of shebangs encontered in a hierarchy.
     """
-    source_files = path.rglob("*.py")
-    shebangs: Dict[str, int] = Counter()
-    shebangs_qty = 0
-    py_files = 0
-    for source_file in source_files:
-        py_files += 1
+
+    suffixes = (".py",)
+    access = Access.FIRST_LINE
+
+    def scan(self, data: bytes) -> Dict[str, int]:
+        if data[0:2] != b"#!":
+            return {"files": 1}
+        facts = {"files": 1, "shebangs": 1}
+        version = re.search(b"python[0-9.]*", data, re.I)
+        if version:
+            facts["shebang:" + version.group(0).decode("ascii")] = 1
+        return facts
+
+    def summarize(self, totals: Counter) -> Dict[str, Union[int, str]]:
+        shebangs: Dict[str, Union[int, str]] = {
+            key: value for key, value in totals.items() if key.startswith("shebang:")
+        }
+        shebangs["shebangs_pct"] = int(
+            100 * (totals["shebangs"] / totals["files"] if totals["files"] else 0)
+        )
+        return shebangs
+
+
+class RequirementsFinder(FileVisitor):
+    """Given the packaging files of a Python project, try to find its
+    requirements, without executing anything.
+    """
+
+    version = 2
+
+    def wants(self, path: PurePosixPath) -> bool:
+        return requirements_format(path) is not None
+
+    def cache_name(self, path: PurePosixPath) -> str:
+        return f"{self.name}:{requirements_format(path)}"
+
+    def scan_file(self, path: PurePosixPath, data: bytes) -> Dict[str, int]:
+        file_format = requirements_format(path)
+        assert file_format is not None
+        return dict.fromkeys(find_requirements(file_format, data), 1)
+
+    def summarize(self, totals: Counter) -> Dict[str, Union[int, str]]:
+        return {"requirements": json.dumps(sorted(totals))}
+
+
+class PycodestyleCounter(FileVisitor):
+    """Count pycodestyle infringements, per error code, calling
+    pycodestyle file by file.
+    """
+
+    suffixes = (".py",)
+
+    def __init__(self) -> None:
+        self._style_guide: Optional[pycodestyle.StyleGuide] = None
+
+    @property
+    def style_guide(self) -> pycodestyle.StyleGuide:
+        """Built on first use, as it reads pycodestyle configuration files.
+        """
+        if self._style_guide is None:
+            self._style_guide = pycodestyle.StyleGuide(quiet=True)
+        return self._style_guide
+
+    def scan(self, data: bytes) -> Dict[str, int]:
         try:
-            with open(source_file) as opened_file:
-                first_line = opened_file.readline()
-            if first_line[0:2] == "#!":
-                shebangs_qty += 1
-                version = re.search("python[0-9.]*", first_line, re.I)
-                if version:
-                    shebangs["shebang:" + version.group(0)] += 1
-        except (UnicodeDecodeError, IsADirectoryError, FileNotFoundError, OSError):
-            # We may open issues for broken symlinks þ
-            pass
-    shebangs = dict(shebangs)
-    shebangs["shebangs_pct"] = int(100 * (shebangs_qty / py_files if py_files else 0))
-    return shebangs
-
-
-def infer_requirements(path: Path) -> Dict[str, str]:
-    """Given the directory of a Python project, try to find its
-    requirements.
-    """
-    import requirements_detector
+            encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+            lines = io.TextIOWrapper(io.BytesIO(data), encoding).readlines()
+        except (LookupError, SyntaxError, UnicodeError):
+            # Same fallback as pycodestyle on improperly declared encodings.
+            lines = io.TextIOWrapper(io.BytesIO(data), "latin-1").readlines()
+        report = pycodestyle.BaseReport(self.style_guide.options)
+        pycodestyle.Checker(
+            lines=lines, options=self.style_guide.options, report=report
+        ).check_all()
+        facts = {
+            code: count
+            for code, count in report.counters.items()
+            if code not in self.style_guide.options.benchmark_keys
+        }
+        facts["files"] = 1
+        return facts
 
-    try:
-        return {
-            "requirements": json.dumps(
-                [
-                    str(requirement)
-                    for requirement in requirements_detector.find_requirements(path)
-                ]
-            )
+    def summarize(self, totals: Counter) -> Dict[str, Union[int, str]]:
+        infringements: Dict[str, Union[int, str]] = {
+            "pep8:" + code: count for code, count in totals.items() if code != "files"
         }
-    except requirements_detector.detect.RequirementsNotFound:
-        return {"requirements": "[]"}
+        infringements["pep8_infringement"] = sum(
+            count for code, count in totals.items() if code != "files"
+        )
+        return infringements
+
+
+IntOrString = TypeVar("IntOrString", int, str, covariant=True)
+T = TypeVar("T")
 
 
-def count_pep8_infringement(path: Path) -> int:
-    """Invoke pycodestyle on a path just to count number of infrigements.
+class Options(NamedTuple):
+    """Settings of an analysis, given to each worker.
     """
-    pycodestyle_result = subprocess.run(
-        ["pycodestyle", "--exclude=.git", "--statistics", "--count", path],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.PIPE,
-        universal_newlines=True,
+
+    only: Optional[str] = None
+    checkout: bool = True
+    cache: Optional[Path] = None
+    cache_size: int = DEFAULT_CACHE_SIZE
+    commits: int = 1
+    history: int = 0
+    seed: Optional[int] = None
+    prune: Tuple[str, ...] = DEFAULT_PRUNE
+    metrics: bool = False
+    profile_dir: Optional[Path] = None
+    jobs: Optional[int] = None
+    timeout: Optional[float] = None
+    memory_limit: Optional[int] = None
+
+
+METHODS: Dict[str, Callable[[Tree], Mapping[str, Union[int, str]]]] = {
+    "has_file": has_typical_files,
+    "has_dir": has_typical_dirs,
+}
+
+FILE_VISITORS: Dict[str, Type[FileVisitor]] = {
+    "license": LicenseIdentifier,
+    "lines_of_code": LinesOfCodeCounter,
+    "shebang": ShebangCounter,
+    "dunder_future": DunderFutureCounter,
+    "pep8_infringement": PycodestyleCounter,
+    "requirements": RequirementsFinder,
+    "detect_test_engine": TestEngineDetector,
+}
+
+
+# Prefixes of the columns given by each analyzer, so the columns an
+# outdated analyzer gave but its new version doesn't can be dropped.
+ANALYZER_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "has_file": ("file:",),
+    "has_dir": ("dir:",),
+    "license": ("license",),
+    "lines_of_code": ("lines_of:",),
+    "shebang": ("shebang:", "shebangs_pct"),
+    "dunder_future": ("dunder_future_pct",),
+    "pep8_infringement": ("pep8:", "pep8_infringement"),
+    "requirements": ("requirements",),
+    "detect_test_engine": ("test_engine",),
+}
+
+
+def analyzer_columns(style: Mapping[str, Any], analyzers: Iterable[str]) -> List[str]:
+    """Columns of the given stats given by the given analyzers.
+    """
+    prefixes = tuple(
+        prefix for analyzer in analyzers for prefix in ANALYZER_COLUMNS[analyzer]
     )
-    if not pycodestyle_result.stderr:
-        return 0
-    try:
-        return int(pycodestyle_result.stderr)
-    except ValueError:
-        # Probably just a warning about pycodestyle itself.
-        return 0
+    return [key for key in style if key.startswith(prefixes)]
 
 
-IntOrString = TypeVar("IntOrString", int, str, covariant=True)
+def analyzers_to_run(
+    only: Optional[str] = None, up_to_date: Optional[Mapping[str, int]] = None
+) -> List[str]:
+    """Names of the analyzers matching `only`, skipping those already
+    run in their current version according to `up_to_date`.
+    """
+    up_to_date = up_to_date or {}
+    return [
+        name
+        for name, analyzer in {**METHODS, **FILE_VISITORS}.items()
+        if (only is None or only in name)
+        and up_to_date.get(name) != getattr(analyzer, "version", 1)
+    ]
+
+
+def file_visitors(to_run: List[str]) -> List[FileVisitor]:
+    """Instantiate the file visitors among the analyzers to run.
+    """
+    return [
+        visitor()
+        for visitor_name, visitor in FILE_VISITORS.items()
+        if visitor_name in to_run
+    ]
 
 
 def infer_style_of_repo(
-    path: Path, only: Optional[str] = None
+    tree: Tree,
+    only: Optional[str] = None,
+    cache: Optional[BlobCache] = None,
+    up_to_date: Optional[Mapping[str, int]] = None,
+    tally: Optional[Tally] = None,
+    prune: Sequence[str] = DEFAULT_PRUNE,
 ) -> Dict[str, Union[str, int]]:
     """Try to infer some basic properties of a Python project like
     presence or absence of typical files, license, …
+
+    The versions of the analyzers that ran are given as a JSON object
+    in the "versions" column.
+
+    File visitors walk the whole tree but the pruned directories,
+    unless the caller maintains their totals in a tally already up to
+    date with the tree.
     """
-    methods: Dict[str, Callable[[Path], Mapping[str, Union[int, str]]]] = {
-        "has_file": has_typical_files,
-        "has_dir": has_typical_dirs,
-        "license": infer_license,
-        "detect_test_engine": detect_test_engine,
-        # 'lines_of_code': count_lines_of_code,
-        # 'pep8_infringement': count_pep8_infringement,
-        "shebang": count_shebangs,
-        "dunder_future": dunder_future,
-        "requirements": infer_requirements,
-    }
+    to_run = analyzers_to_run(only, up_to_date)
     result: Dict[str, Union[int, str]] = {}
+    versions: Dict[str, int] = {}
     try:
-        for method_name, method in methods.items():
-            if only is None or only in method_name:
-                result.update(method(path))
+        for method_name, method in METHODS.items():
+            if method_name in to_run:
+                with metrics.scope(method_name):
+                    result.update(method(tree))
+                versions[method_name] = getattr(method, "version", 1)
+        with metrics.scope("walk"):
+            if tally is None:
+                result.update(walk(tree, file_visitors(to_run), cache, prune))
+            else:
+                result.update(tally.stats())
+        versions.update(
+            {
+                visitor_name: visitor.version
+                for visitor_name, visitor in FILE_VISITORS.items()
+                if visitor_name in to_run
+            }
+        )
+    except MemoryError:
+        raise
     except Exception:  # pylint: disable=broad-except
         import traceback
 
         traceback.print_exc()
-        logger.exception(f"Unhandled exception while infering style of {path!r}")
-
+        logger.exception(f"Unhandled exception while infering style of {tree!r}")
+    result["versions"] = json.dumps(versions, sort_keys=True)
     return result
 
 
+def count_commits(repo_path: Path, start: str = "HEAD") -> int:
+    """Count the commits in the history of the given commit.
+
+    As this never changes for a given commit, the last count is kept
+    in the repository, so huge histories are only counted once per
+    pull instead of once per run.
+    """
+    commit = subprocess.check_output(
+        ("git", "-C", str(repo_path), "rev-parse", start), universal_newlines=True
+    ).strip()
+    counts_file = repo_path / ".git" / "pystyle-commit-count"
+    try:
+        counted_commit, counted = counts_file.read_text().split()
+        if counted_commit == commit:
+            return int(counted)
+    except (OSError, ValueError):
+        pass  # Missing or corrupt, count again.
+    count = int(
+        subprocess.check_output(
+            ("git", "-C", str(repo_path), "rev-list", "--count", commit),
+            universal_newlines=True,
+        )
+    )
+    try:
+        counts_file.write_text(f"{commit} {count}\n")
+    except OSError:
+        logger.warning("Can't cache commit count of %r", repo_path)
+    return count
+
+
+def repo_random(repo_path: Path, seed: Optional[int] = None) -> random.Random:
+    """Random generator used to pick commits of a repo.
+
+    Given a seed, the same commits are picked on each run, whatever the
+    order in which workers process repos.
+    """
+    if seed is None:
+        return random.Random()
+    return random.Random(f"{seed}:{'/'.join(repo_path.parts[-3:])}")
+
+
+def pick_random_commits(
+    repo_path: Path,
+    count: int,
+    start: str = "HEAD",
+    rng: Optional[random.Random] = None,
+) -> List[str]:
+    """Pick distinct random commits in the history of the given commit,
+    most recent first.
+
+    Commits are picked by position, then `git rev-list` output is
+    streamed from the first to the last picked position only, so the
+    history is never held in memory.
+    """
+    rng = rng or random.Random()
+    total = count_commits(repo_path, start)
+    positions = sorted(rng.sample(range(total), min(count, total)))
+    if not positions:
+        return []
+    first, last = positions[0], positions[-1]
+    wanted = {position - first for position in positions}
+    picked = []
+    with subprocess.Popen(
+        ("git", "-C", str(repo_path), "rev-list", f"--skip={first}")
+        + (f"--max-count={last - first + 1}", start),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ) as rev_list:
+        assert rev_list.stdout is not None  # It's a pipe.
+        try:
+            for position, commit in enumerate(rev_list.stdout):
+                if position in wanted:
+                    picked.append(commit.strip())
+        except BaseException:
+            rev_list.kill()
+            raise
+    if rev_list.returncode:
+        raise subprocess.CalledProcessError(rev_list.returncode, rev_list.args)
+    return picked
+
+
+def pick_random_commit(
+    repo_path: Path, start: str = "HEAD", rng: Optional[random.Random] = None
+) -> str:
+    """Pick a random commit in the history of the given commit.
+    """
+    return pick_random_commits(repo_path, 1, start, rng)[0]
+
+
+def pick_commits_over_time(repo_path: Path, count: int) -> List[str]:
+    """Pick up to count commits of the first-parent history, evenly
+    spread over time, oldest first.
+    """
+    commits = [
+        (commit, int(timestamp))
+        for commit, timestamp in (
+            line.split()
+            for line in subprocess.check_output(
+                ("git", "-C", str(repo_path), "log", "--first-parent", "--reverse")
+                + ("--format=%H %ct", "HEAD"),
+                universal_newlines=True,
+            ).splitlines()
+        )
+    ]
+    if len(commits) <= count:
+        return [commit for commit, _ in commits]
+    first, last = commits[0][1], commits[-1][1]
+    picked: List[str] = []
+    index = 0
+    for sample in range(count):
+        target = last if count == 1 else first + (last - first) * sample / (count - 1)
+        while index + 1 < len(commits) and commits[index + 1][1] <= target:
+            index += 1
+        if not picked or picked[-1] != commits[index][0]:
+            picked.append(commits[index][0])
+    return picked
+
+
+def changed_files(repo_path: Path, old: str, new: str) -> List[PurePosixPath]:
+    """Files added, modified or deleted between two commits.
+    """
+    diff = subprocess.check_output(
+        ("git", "-C", str(repo_path), "diff", "--name-only", "-z", "--no-renames")
+        + (old, new)
+    )
+    return [PurePosixPath(os.fsdecode(name)) for name in diff.split(b"\0") if name]
+
+
+def get_commit_date(repo_path: Path, commit: str) -> str:
+    """Get the committer date of the given commit, in strict ISO 8601.
+    """
+    return subprocess.check_output(
+        ("git", "-C", str(repo_path), "show", "--pretty=format:%cI", "-s", commit),
+        universal_newlines=True,
+    )
+
+
+def current_branch(repo_path: Path) -> Optional[str]:
+    """Get the branch checked out in a repo, None if HEAD is detached.
+    """
+    try:
+        return subprocess.check_output(
+            ("git", "-C", str(repo_path), "symbolic-ref", "-q", "--short", "HEAD"),
+            universal_newlines=True,
+        ).rstrip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def default_branch(repo_path: Path) -> Optional[str]:
+    """Get the default branch of the origin remote, from origin/HEAD.
+    """
+    try:
+        origin_head = subprocess.check_output(
+            (
+                "git",
+                "-C",
+                str(repo_path),
+                "symbolic-ref",
+                "-q",
+                "--short",
+                "refs/remotes/origin/HEAD",
+            ),
+            universal_newlines=True,
+        ).rstrip()
+    except subprocess.CalledProcessError:
+        return None
+    return origin_head.split("/", 1)[-1]
+
+
+def restore_head(repo_path: Path, branch: Optional[str], commit: str) -> None:
+    """Checkout back the branch, or the commit if HEAD was detached.
+    """
+    logger.info("Checking out back to %r", branch or commit)
+    with metrics.scope("checkout"):
+        subprocess.check_call(
+            ("git", "-C", str(repo_path), "checkout", "-f", branch or commit),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+
 class random_commit:
     """Context manager to temporarily checkout a random commit in an history
     """
 
-    def __init__(self, repo_path: Path) -> None:
+    def __init__(self, repo_path: Path, rng: Optional[random.Random] = None) -> None:
         self.initial_commit = None
+        self.initial_branch: Optional[str] = None
         self.repo_path = repo_path
+        self.rng = rng
 
     def pick_random_commit(self):
-        return random.choice(
-            [
-                commit
-                for commit in subprocess.check_output(
-                    ("git", "-C", str(self.repo_path), "rev-list", self.initial_commit),
-                    universal_newlines=True,
-                ).split("\n")
-                if commit
-            ]
-        )
+        return pick_random_commit(self.repo_path, self.initial_commit, self.rng)
 
     def fix_checkout(self):
-        status = subprocess.check_output(
-            ["git", "-C", str(self.repo_path), "status"], universal_newlines=True
-        )
-        if b"detached at" not in status:
+        """Get back on a branch a clone left detached, preferably the
+        default one from origin/HEAD.
+        """
+        if current_branch(self.repo_path) is not None:
             return
         logger.info("Trying to fix checkout of %r", self.repo_path)
-        branches = subprocess.check_output(["git", "-C", str(self.repo_path), "branch"])
-        upstream_branch = [
-            branch.strip() for branch in branches.split("\n") if " " not in branch
-        ][0]
-        subprocess.check_output(
-            ["git", "-C", str(self.repo_path), "checkout", "-f", upstream_branch]
-        )
-
-    def __enter__(self):
-        self.fix_checkout()
-        self.initial_commit = subprocess.check_output(
-            ("git", "-C", str(self.repo_path), "rev-parse", "HEAD"),
+        branches = subprocess.check_output(
+            (
+                "git",
+                "-C",
+                str(self.repo_path),
+                "for-each-ref",
+                "--format=%(refname:short)",
+                "refs/heads/",
+            ),
             universal_newlines=True,
-        ).rstrip()
-        commit = self.pick_random_commit()
-        logger.info("Checking out random commit %r", commit)
+        ).split()
+        if not branches:
+            return
+        default = default_branch(self.repo_path)
         subprocess.check_call(
-            ("git", "-C", str(self.repo_path), "checkout", "-f", commit),
+            (
+                "git",
+                "-C",
+                str(self.repo_path),
+                "checkout",
+                "-f",
+                default if default in branches else branches[0],
+            ),
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
         )
+
+    def __enter__(self):
+        with metrics.scope("checkout"):
+            self.fix_checkout()
+            self.initial_branch = current_branch(self.repo_path)
+            self.initial_commit = subprocess.check_output(
+                ("git", "-C", str(self.repo_path), "rev-parse", "HEAD"),
+                universal_newlines=True,
+            ).rstrip()
+            commit = self.pick_random_commit()
+            logger.info("Checking out random commit %r", commit)
+            subprocess.check_call(
+                ("git", "-C", str(self.repo_path), "checkout", "-f", commit),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
         return commit
 
     def __exit__(self, *exc):
-        logger.info("Checking out back to %r", self.initial_commit)
-        subprocess.check_call(
-            ("git", "-C", str(self.repo_path), "checkout", "-f", self.initial_commit),
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+        restore_head(self.repo_path, self.initial_branch, self.initial_commit)
 
 
 class commit:
@@ -371,62 +980,260 @@ class commit:
 
     def __init__(self, repo_path: Path, commit: str) -> None:
         self.initial_commit = None
+        self.initial_branch: Optional[str] = None
         self.target_commit = commit
         self.repo_path = repo_path
 
     def __enter__(self):
-        self.initial_commit = subprocess.check_output(
-            ("git", "-C", str(self.repo_path), "rev-parse", "HEAD"),
-            universal_newlines=True,
-        ).rstrip()
-        logger.info("Checking out random commit %r", self.target_commit)
-        subprocess.check_call(
-            ("git", "-C", str(self.repo_path), "checkout", "-f", self.target_commit),
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-        return commit
+        with metrics.scope("checkout"):
+            self.initial_branch = current_branch(self.repo_path)
+            self.initial_commit = subprocess.check_output(
+                ("git", "-C", str(self.repo_path), "rev-parse", "HEAD"),
+                universal_newlines=True,
+            ).rstrip()
+            logger.info("Checking out random commit %r", self.target_commit)
+            subprocess.check_call(
+                ("git", "-C", str(self.repo_path), "checkout", "-f")
+                + (self.target_commit,),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        return self.target_commit
 
     def __exit__(self, *exc):
-        logger.info("Checking out back to %r", self.initial_commit)
-        subprocess.check_call(
-            ("git", "-C", str(self.repo_path), "checkout", "-f", self.initial_commit),
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+        restore_head(self.repo_path, self.initial_branch, self.initial_commit)
 
 
-def infer_style(repo: Path, only: str = None) -> Optional[Dict[str, Union[str, int]]]:
+def infer_style(
+    repo: Path, options: Options = Options(), commit: Optional[str] = None
+) -> Optional[Dict[str, Union[str, int]]]:
+    """Infer the style of a random commit of a repo, or of the given
+    commit, checked out in a worktree so others can be analyzed at the
+    same time.
+    """
     logger.info("Working on repo %r", repo)
-    with random_commit(repo) as commit:
-        commit_date = subprocess.check_output(
-            ("git", "-C", str(repo), "show", "--pretty=format:%cI", "-s"),
-            universal_newlines=True,
+    with recording(options.metrics, options.profile_dir) as record, open_cache(
+        options.cache, options.cache_size
+    ) as cache:
+        if options.checkout and commit is None:
+            with random_commit(repo, repo_random(repo, options.seed)) as commit:
+                style = infer_style_of_repo(
+                    WorkTree(repo), options.only, cache, prune=options.prune
+                )
+        else:
+            commit = commit or pick_random_commit(
+                repo, rng=repo_random(repo, options.seed)
+            )
+            if options.checkout:
+                with worktree(repo, commit) as path:
+                    style = infer_style_of_repo(
+                        WorkTree(path), options.only, cache, prune=options.prune
+                    )
+            else:
+                with CatFile(repo) as cat_file:
+                    style = infer_style_of_repo(
+                        GitTree(repo, commit, cat_file),
+                        options.only,
+                        cache,
+                        prune=options.prune,
+                    )
+        style.update(
+            {"commit": commit, "repo": str(repo), "date": get_commit_date(repo, commit)}
         )
-        style = infer_style_of_repo(repo, only)
-        style.update({"commit": commit, "repo": str(repo), "date": commit_date})
-        return style
+    if options.metrics:
+        style["metrics"] = json.dumps(record)
+    return style
+
+
+def infer_style_history(
+    repo: Path, options: Options = Options()
+) -> List[Dict[str, Union[str, int]]]:
+    """Infer the style of `options.history` commits of a repo, evenly
+    spread over its history.
+
+    Commits are read from the object database. Only the first one is
+    fully walked, the file visitors' totals are then updated with the
+    files changed since the previous sample.
+    """
+    logger.info("Working on the history of repo %r", repo)
+    styles = []
+    with open_cache(options.cache, options.cache_size) as cache, CatFile(
+        repo
+    ) as cat_file:
+        tally = Tally(
+            file_visitors(analyzers_to_run(options.only)),
+            cache,
+            keep_files=True,
+            prune=options.prune,
+        )
+        previous = None
+        for commit in pick_commits_over_time(repo, options.history):
+            with recording(options.metrics, options.profile_dir) as record:
+                tree = GitTree(repo, commit, cat_file)
+                files = set(tree.files())
+                if previous is None:
+                    changed: Iterable[PurePosixPath] = files
+                else:
+                    changed = changed_files(repo, previous, commit)
+                for path in changed:
+                    tally.remove(path)
+                    if path in files:
+                        tally.add(tree, path)
+                style = infer_style_of_repo(tree, options.only, cache, tally=tally)
+                style.update(
+                    {
+                        "commit": commit,
+                        "repo": str(repo),
+                        "date": get_commit_date(repo, commit),
+                    }
+                )
+            if options.metrics:
+                style["metrics"] = json.dumps(record)
+            styles.append(style)
+            previous = commit
+    return styles
+
+
+def init_worker(memory_limit: Optional[int], log_level: int) -> None:
+    """Pool initializer limiting the heap of a worker, and setting up its
+    logging when it is not a fork of a process which did.
+    """
+    limit_memory(memory_limit)
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=log_level,
+            stream=sys.stdout,
+            format="[%(asctime)s] %(levelname)s:%(name)s:%(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+
+
+def worker_pool(
+    options: Options, start_method: Optional[str] = None
+) -> multiprocessing.pool.Pool:
+    """Pool of `options.jobs` workers, each limited to
+    `options.memory_limit` megabytes of heap, started with the given
+    multiprocessing start method, or the default one.
+    """
+    return multiprocessing.get_context(start_method).Pool(
+        options.jobs,
+        initializer=init_worker,
+        initargs=(options.memory_limit, logging.getLogger().getEffectiveLevel()),
+    )
+
+
+def failure_reason(error: BaseException) -> str:
+    """Name of the limit an analysis hit.
+    """
+    return "timeout" if isinstance(error, TaskTimeout) else "memory"
+
+
+def within_limits(
+    analysis: Callable[..., T],
+    repo: Path,
+    options: Options,
+    commit: Optional[str] = None,
+) -> Union[T, Failure]:
+    """Run the analysis of a repo, or of one of its commits, within the
+    time limit of the options, giving a Failure if it hits a limit, or
+    if it fails, so a single broken repo doesn't stop a whole run.
+    """
+    try:
+        with time_limit(options.timeout):
+            if commit is None:
+                return analysis(repo, options)
+            return analysis(repo, options, commit)
+    except (TaskTimeout, MemoryError) as error:
+        reason = failure_reason(error)
+        logger.warning("Giving up %s at %s: %s", repo, commit or "any commit", reason)
+        return Failure(str(repo), commit, reason)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Can't analyze %s at %s", repo, commit or "any commit")
+        return Failure(str(repo), commit, "error")
 
 
-def update_style(git_store: Path, only: str, line: dict):
+def largest_repos_first(
+    pool: multiprocessing.pool.Pool, git_store: Path, lines: Sequence[Mapping[str, Any]]
+) -> List[int]:
+    """Order in which to update stats lines, those of the largest repos
+    first.
+    """
+    repos = largest_first(pool, sorted({git_store / line["repo"] for line in lines}))
+    rank = {repo: index for index, repo in enumerate(repos)}
+    return sorted(
+        range(len(lines)), key=lambda index: rank[git_store / lines[index]["repo"]]
+    )
+
+
+def update_style(git_store: Path, options: Options, line: dict):
     repo = git_store / line["repo"]
-    with commit(repo, line["commit"]):
-        line.update(infer_style_of_repo(repo, only))
+    versions = json.loads(line.get("versions") or "{}")
+    if not analyzers_to_run(options.only, versions):
+        return line
+    try:
+        with time_limit(options.timeout), open_cache(
+            options.cache, options.cache_size
+        ) as cache:
+            if options.checkout:
+                with commit(repo, line["commit"]):
+                    style = infer_style_of_repo(
+                        WorkTree(repo),
+                        options.only,
+                        cache,
+                        versions,
+                        prune=options.prune,
+                    )
+            else:
+                with CatFile(repo) as cat_file:
+                    style = infer_style_of_repo(
+                        GitTree(repo, line["commit"], cat_file),
+                        options.only,
+                        cache,
+                        versions,
+                        prune=options.prune,
+                    )
+    except (TaskTimeout, MemoryError) as error:
+        logger.warning(
+            "Keeping outdated stats of %s at %s: %s",
+            line["repo"],
+            line["commit"],
+            failure_reason(error),
+        )
+        return line
+    except Exception:  # pylint: disable=broad-except
+        logger.exception(
+            "Keeping outdated stats of %s at %s", line["repo"], line["commit"]
+        )
         return line
+    new_versions = json.loads(str(style.pop("versions")))
+    for column in analyzer_columns(line, new_versions):
+        del line[column]
+    versions.update(new_versions)
+    line.update(style)
+    line["versions"] = json.dumps(versions, sort_keys=True)
+    return line
 
 
 def update_style_of_all_repos(
-    git_store: Path, stats_csv: Path, only: str = None
+    git_store: Path, stats_csv: Path, options: Options = Options()
 ) -> None:
-    """Recompute the stats of an existing stats file.
+    """Recompute the stats of an existing stats file, only running
+    analyzers whose version changed since each line was computed.
     """
-    with open(stats_csv, "r", newline="\n") as csv_file, Pool(processes=4) as pool:
+    with open(stats_csv, "r", newline="\n") as csv_file, worker_pool(options) as pool:
         reader = csv.DictReader(csv_file, dialect=csv.unix_dialect)
-        all_styles = pool.starmap(
-            update_style, ((git_store, only, line) for line in reader)
+        lines = list(reader)
+        order = largest_repos_first(pool, git_store, lines)
+        updated = pool.map(
+            functools.partial(update_style, git_store, options),
+            [lines[index] for index in order],
         )
-        fieldnames = reader.fieldnames
-    all_styles = [style for style in all_styles if style is not None]
+        fieldnames = list(reader.fieldnames or [])
+    all_styles = [
+        style for _, style in sorted(zip(order, updated)) if style is not None
+    ]
+    for style in all_styles:
+        fieldnames.extend(key for key in style if key not in fieldnames)
     with open(
         str(stats_csv).replace(".csv", "-new.csv"), "w", newline="\n"
     ) as csv_file:
@@ -437,25 +1244,255 @@ def update_style_of_all_repos(
         writer.writerows(all_styles)
 
 
-def infer_style_of_all_repos(
-    git_store: Path, stats_csv: Path, only: str = None
+def update_style_of_store(
+    git_store: Path,
+    store: Path,
+    stats_csv: Path,
+    options: Options = Options(),
+    columnar: Optional[Path] = None,
 ) -> None:
-    """Compute stats file from a bunch of clones.
+    """Recompute the outdated stats of a stats store, only touching the
+    metrics of the commits having analyzers whose version changed, then
+    export the store as a CSV file, and optionally as a columnar file.
+    """
+    with StatsStore(store) as stats_store:
+        outdated = [
+            style
+            for style in stats_store.styles()
+            if analyzers_to_run(options.only, json.loads(style.get("versions") or "{}"))
+        ]
+        with worker_pool(options) as pool:
+            order = largest_repos_first(pool, git_store, outdated)
+            metrics = {
+                (style["repo"], style["commit"]): set(style) for style in outdated
+            }
+            for style in pool.imap_unordered(
+                functools.partial(update_style, git_store, options),
+                [outdated[index] for index in order],
+            ):
+                stats_store.write(
+                    style, dropped=metrics[style["repo"], style["commit"]] - set(style)
+                )
+        stats_store.export_csv(stats_csv)
+        if columnar is not None:
+            export_columnar(stats_store.styles, columnar)
+
+
+def export_columnar(
+    read_styles: Callable[[], Iterable[Mapping[str, Union[str, int]]]], path: Path
+) -> None:
+    """Export stats to a Parquet or Arrow IPC file, importing pyarrow
+    only when needed.
+    """
+    from pystyle import columnar
+
+    columnar.export_columnar(read_styles, path)
+
+
+def failures_path(stats_csv: Path) -> Path:
+    """JSON lines file recording the analyses that hit a limit.
+    """
+    return stats_csv.with_name(stats_csv.stem + "-failures.jsonl")
+
+
+def task_repo(task: Union[Tuple, Mapping[str, Any], Failure]) -> str:
+    """Repo of an analysis task, of its stats, or of its failure.
+    """
+    if isinstance(task, Failure):
+        return task.repo
+    if isinstance(task, tuple):
+        return str(task[0])
+    return task["repo"]
+
+
+CommitTask = Union[Tuple[Path, str, Options], Failure]
+
+
+def _pick_commits(repo: Path, options: Options) -> List[CommitTask]:
+    """Tasks analyzing `options.commits` random commits of a repo, or
+    the failure to pick them.
     """
-    with Pool(processes=8) as pool:
-        all_styles = pool.starmap(
-            infer_style, [(path, only) for path in git_store.glob("*/*/*/")]
+    try:
+        commits = pick_random_commits(
+            repo, options.commits, rng=repo_random(repo, options.seed)
         )
-    all_styles = [style for style in all_styles if style is not None]
-    for style in all_styles:
-        style["repo"] = Path(style["repo"]).relative_to(git_store)
-    headers = {key for style in all_styles for key in set(style)}
-    with open(stats_csv, "w") as csv_file:
-        writer = csv.DictWriter(
-            csv_file, fieldnames=list(headers), dialect=csv.unix_dialect
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Can't pick commits of %r", repo)
+        return [Failure(str(repo), None, "error")]
+    return [(repo, commit, options) for commit in commits]
+
+
+def _infer_style_of_commit(task: CommitTask):
+    if isinstance(task, Failure):
+        return task
+    repo, commit, options = task
+    return within_limits(infer_style, repo, options, commit)
+
+
+def infer_style_of_commits(
+    pool: multiprocessing.pool.Pool, repos: List[Path], options: Options
+) -> Iterator[Union[Dict[str, Union[str, int]], Failure]]:
+    """Infer the style of `options.commits` random commits per repo,
+    spreading the commits of each repo over all workers.
+
+    Commits are picked in the pool too, and the commits of a repo are
+    analyzed as soon as they are picked. Worktrees of a repo are
+    removed once all its commits are done.
+    """
+    remaining: Counter = Counter()
+    lock = threading.Lock()
+    # Queued before the analyses, whose tasks are generated from their
+    # results by the single task handler thread of the pool.
+    picks = pool.imap_unordered(
+        functools.partial(_pick_commits, options=options), repos
+    )
+
+    def picked_tasks() -> Iterator[CommitTask]:
+        for tasks in picks:
+            with lock:
+                for task in tasks:
+                    remaining[Path(task_repo(task))] += 1
+            yield from tasks
+
+    for style in pool.imap_unordered(_infer_style_of_commit, picked_tasks()):
+        repo = Path(task_repo(style))
+        with lock:
+            remaining[repo] -= 1
+            done = not remaining[repo]
+        if done and options.checkout:
+            remove_worktrees(repo)
+        yield style
+
+
+def flatten_histories(
+    histories: Iterable[Union[List[Dict[str, Union[str, int]]], Failure]]
+) -> Iterator[Union[Dict[str, Union[str, int]], Failure]]:
+    """Stats of each sampled commit of the given histories.
+    """
+    for history in histories:
+        if isinstance(history, Failure):
+            yield history
+        else:
+            yield from history
+
+
+def infer_style_of_repos(
+    pool: multiprocessing.pool.Pool, repos: List[Path], options: Options
+) -> Iterator[Union[Optional[Dict[str, Union[str, int]]], Failure]]:
+    """Infer the style of the given repos, as requested by the options,
+    yielding stats as soon as they are computed, or a Failure for the
+    analyses hitting a limit.
+
+    Largest repos are started first, so they don't hold up the end of
+    the run.
+    """
+    repos = largest_first(pool, repos)
+    if options.history:
+        return flatten_histories(
+            pool.imap_unordered(
+                functools.partial(within_limits, infer_style_history, options=options),
+                repos,
+            )
         )
-        writer.writeheader()
-        writer.writerows(all_styles)
+    if options.commits == 1:
+        return pool.imap_unordered(
+            functools.partial(within_limits, infer_style, options=options), repos
+        )
+    return infer_style_of_commits(pool, repos, options)
+
+
+def collect_styles(
+    styles: Iterable[Union[Optional[Dict[str, Union[str, int]]], Failure]],
+    git_store: Path,
+    failures_file: TextIO,
+    report: Optional[MetricsReport] = None,
+) -> Iterator[Dict[str, Union[str, int]]]:
+    """Prepare computed stats to be stored: repos are given relative to
+    the git store, metrics of the analyses are moved to the report, and
+    failures are recorded in the failures file.
+    """
+    for style in styles:
+        if style is None:
+            continue
+        if isinstance(style, Failure):
+            failure = style._replace(repo=str(Path(style.repo).relative_to(git_store)))
+            failures_file.write(json.dumps(failure._asdict()) + "\n")
+            failures_file.flush()
+            continue
+        repo = str(Path(str(style["repo"])).relative_to(git_store))
+        style["repo"] = repo
+        record = style.pop("metrics", None)
+        if report is not None and isinstance(record, str):
+            report.add(repo, str(style["commit"]), json.loads(record))
+        yield style
+
+
+def infer_style_of_all_repos(
+    git_store: Path,
+    stats_csv: Path,
+    options: Options = Options(),
+    resume: bool = False,
+    store: Optional[Path] = None,
+    columnar: Optional[Path] = None,
+    metrics_file: Optional[Path] = None,
+    profiles: int = 0,
+) -> None:
+    """Compute stats file from a bunch of clones.
+
+    Stats are appended to a JSON lines file next to the CSV file, or
+    upserted in the given stats store, as soon as each repo is done, so
+    a crashed run can be resumed. They are finally exported as a CSV
+    file, and optionally as a columnar file.
+
+    Given a metrics file, analyses are instrumented and a report is
+    written to it, along with the cProfile dumps of the `profiles`
+    slowest analyses in a `-profiles` directory next to it.
+
+    Analyses hitting the time or memory limit, or failing, are recorded
+    in a -failures.jsonl file next to the CSV file, and not retried on
+    resume.
+    """
+    failures_jsonl = failures_path(stats_csv)
+    failed = set()
+    if resume and failures_jsonl.exists():
+        drop_partial_line(failures_jsonl)
+        failed = {failure["repo"] for failure in read_jsonl(failures_jsonl)}
+    report = None
+    if metrics_file is not None:
+        report = MetricsReport(profiles)
+        profile_dir = None
+        if profiles:
+            profile_dir = metrics_file.with_name(metrics_file.stem + "-profiles")
+            profile_dir.mkdir(parents=True, exist_ok=True)
+        options = options._replace(metrics=True, profile_dir=profile_dir)
+    writer: StatsWriter
+    if store is not None:
+        writer = StatsStore(store)
+    else:
+        writer = StatsJSONL(stats_csv.with_suffix(".jsonl"), resume)
+    with writer:
+        done = (writer.repos() if resume else set()) | failed
+        repos = [
+            path
+            for path in git_store.glob("*/*/*/")
+            if str(path.relative_to(git_store)) not in done
+        ]
+        with open(failures_jsonl, "a" if resume else "w") as failures_file, worker_pool(
+            options
+        ) as pool:
+            for style in collect_styles(
+                infer_style_of_repos(pool, repos, options),
+                git_store,
+                failures_file,
+                report,
+            ):
+                writer.write(style)
+        writer.done()
+        writer.export_csv(stats_csv)
+        if columnar is not None:
+            export_columnar(writer.styles, columnar)
+    if report is not None and metrics_file is not None:
+        report.write(metrics_file)
 
 
 def main() -> None:
@@ -469,10 +1506,28 @@ def main() -> None:
         format="[%(asctime)s] %(levelname)s:%(name)s:%(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
+    options = options_from_args(args)._replace(commits=args.commits)
     if not args.update:
-        infer_style_of_all_repos(Path(args.git_store), Path(args.stats_csv), args.only)
+        infer_style_of_all_repos(
+            Path(args.git_store),
+            Path(args.stats_csv),
+            options,
+            args.resume,
+            args.store,
+            args.columnar,
+            args.metrics,
+            args.profile,
+        )
+    elif args.store:
+        update_style_of_store(
+            Path(args.git_store),
+            args.store,
+            Path(args.stats_csv),
+            options,
+            args.columnar,
+        )
     else:
-        update_style_of_all_repos(Path(args.git_store), Path(args.stats_csv), args.only)
+        update_style_of_all_repos(Path(args.git_store), Path(args.stats_csv), options)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,305 @@
+"""Walk a tree of files once, feeding each file to every analyzer
+interested in it.
+"""
+
+import enum
+import fnmatch
+import functools
+import itertools
+from collections import Counter
+from pathlib import PurePosixPath
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from pystyle import metrics
+from pystyle.cache import BlobCache
+from pystyle.tree import Tree
+
+
+class Access(enum.Enum):
+    """How much of a file a visitor needs to see."""
+
+    FIRST_LINE = 1
+    CHUNKS = 2
+    CONTENT = 3
+
+
+CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_PRUNE = (
+    "venv",
+    ".venv",
+    "virtualenv",
+    "site-packages",
+    "node_modules",
+    "build",
+    ".tox",
+    "vendor",
+    "vendored",
+    "_vendor",
+    "third_party",
+)
+
+
+class FileVisitor:
+    """Base class for analyzers working file by file.
+
+    A visitor declares which files it wants (by suffix, all files if
+    empty) and whether it needs only their first line, their content
+    chunk by chunk, or their whole content at once. The walker opens
+    each file at most once, whatever the number of visitors interested
+    in it.
+
+    As the facts extracted by `scan` only depend on the data, they may
+    be cached by blob SHA: bump `version` when they change. Visitors
+    reading files differently depending on their path override
+    `scan_file` and give distinct `cache_name`s to each way.
+    """
+
+    version = 1
+    suffixes: Tuple[str, ...] = ()
+    access = Access.CONTENT
+
+    @property
+    def name(self) -> str:
+        """Name of the visitor, as used by the cache.
+        """
+        return type(self).__name__
+
+    def wants(self, path: PurePosixPath) -> bool:
+        """Tell if the given file should be given to this visitor.
+        """
+        return not self.suffixes or path.suffix.lower() in self.suffixes
+
+    def cache_name(self, path: PurePosixPath) -> str:
+        """Name under which the facts found in the given file are cached.
+        """
+        return self.name
+
+    def scan(self, data: bytes) -> Dict[str, int]:
+        """Extract facts from the first line or the content of a single file.
+        """
+        raise NotImplementedError
+
+    def scan_file(  # pylint: disable=unused-argument
+        self, path: PurePosixPath, data: bytes
+    ) -> Dict[str, int]:
+        """Extract facts from the content of the given file.
+        """
+        return self.scan(data)
+
+    def scan_chunks(self, chunks: Iterable[bytes]) -> Dict[str, int]:
+        """Extract facts from the content of a single file, given as
+        successive chunks so big files are never loaded at once.
+        """
+        return self.scan(b"".join(chunks))
+
+    def tally(  # pylint: disable=no-self-use,unused-argument
+        self, path: PurePosixPath, facts: Mapping[str, int]
+    ) -> Mapping[str, int]:
+        """Give the contribution of a single file to the totals.
+        """
+        return facts
+
+    def summarize(  # pylint: disable=no-self-use
+        self, totals: Counter
+    ) -> Dict[str, Union[int, str]]:
+        """Turn the totals of all files into stats.
+        """
+        return dict(totals)
+
+
+def first_line(data: bytes) -> bytes:
+    """Return the first line of the given data, with its line terminator.
+    """
+    line, newline, _ = data.partition(b"\n")
+    return line + newline
+
+
+def is_pruned(path: PurePosixPath, prune: Sequence[str]) -> bool:
+    """Tell if a file is in a directory matching one of the given
+    glob patterns, like bundled virtualenvs or vendored projects.
+    """
+    return any(
+        fnmatch.fnmatchcase(directory, pattern)
+        for directory in path.parts[:-1]
+        for pattern in prune
+    )
+
+
+def counted(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Count the bytes read by the walk while streaming chunks.
+    """
+    for chunk in chunks:
+        metrics.count("bytes_read", len(chunk), "walk")
+        yield chunk
+
+
+Contributions = List[Tuple[int, Mapping[str, int]]]
+
+
+class Tally:
+    """Running totals of some visitors over the files of a tree.
+
+    Given a cache, files whose blob has already been seen by all
+    interested visitors are not even opened.
+
+    Files in pruned directories are not visited, only counted.
+
+    With keep_files, the contribution of each file is remembered so it
+    can later be removed, to follow a tree from commit to commit by
+    only visiting the files that changed.
+    """
+
+    def __init__(
+        self,
+        visitors: Sequence[FileVisitor],
+        cache: Optional[BlobCache] = None,
+        keep_files: bool = False,
+        prune: Sequence[str] = DEFAULT_PRUNE,
+    ) -> None:
+        self.visitors = visitors
+        self.cache = cache
+        self.prune = prune
+        self.totals: List[Counter] = [Counter() for _ in visitors]
+        self.skipped = 0
+        self.files: Optional[Dict[PurePosixPath, Contributions]] = (
+            {} if keep_files else None
+        )
+        self.skipped_files: Optional[Set[PurePosixPath]] = (
+            set() if keep_files else None
+        )
+
+    def add(self, tree: Tree, path: PurePosixPath) -> None:
+        """Feed a file of the tree to the interested visitors.
+        """
+        if is_pruned(path, self.prune):
+            self.skipped += 1
+            if self.skipped_files is not None:
+                self.skipped_files.add(path)
+            return
+        contributions = self.visit(tree, path)
+        for index, contribution in contributions:
+            self.totals[index].update(contribution)
+        if self.files is not None and contributions:
+            self.files[path] = contributions
+
+    def remove(self, path: PurePosixPath) -> None:
+        """Withdraw the contribution of a previously added file.
+        """
+        if self.files is None or self.skipped_files is None:
+            raise ValueError("Files are only removable from a Tally with keep_files.")
+        if path in self.skipped_files:
+            self.skipped_files.remove(path)
+            self.skipped -= 1
+        for index, contribution in self.files.pop(path, ()):
+            self.totals[index].subtract(contribution)
+
+    def visit(self, tree: Tree, path: PurePosixPath) -> Contributions:
+        """Compute the contribution of a file to the totals of each
+        interested visitor, opening it only on cache misses.
+        """
+        interested = [
+            index for index, visitor in enumerate(self.visitors) if visitor.wants(path)
+        ]
+        if not interested:
+            return []
+        cache = self.cache
+        blob = tree.blob_id(path) if cache is not None else None
+        contributions: Contributions = []
+        pending = []
+        for index in interested:
+            visitor = self.visitors[index]
+            facts = (
+                cache.get(blob, visitor.cache_name(path), visitor.version)
+                if cache is not None and blob is not None
+                else None
+            )
+            if facts is None:
+                pending.append(index)
+            else:
+                metrics.count("cache_hits", 1, "walk")
+                contributions.append((index, visitor.tally(path, facts)))
+        if not pending:
+            return contributions
+        metrics.count("files_opened", 1, "walk")
+        accesses = [self.visitors[index].access for index in pending]
+        streamed = accesses.count(Access.CHUNKS) == 1 and Access.CONTENT not in accesses
+        streamed_facts = {}
+        try:
+            with tree.open(path) as opened_file:
+                if streamed:
+                    data = opened_file.readline(CHUNK_SIZE)
+                    chunks = counted(
+                        itertools.chain(
+                            (data,),
+                            iter(functools.partial(opened_file.read, CHUNK_SIZE), b""),
+                        )
+                    )
+                    for index in pending:
+                        visitor = self.visitors[index]
+                        if visitor.access is Access.CHUNKS:
+                            with metrics.scope(visitor.name):
+                                streamed_facts[index] = visitor.scan_chunks(chunks)
+                else:
+                    if Access.CONTENT in accesses or Access.CHUNKS in accesses:
+                        data = opened_file.read()
+                    else:
+                        data = opened_file.readline()
+                    metrics.count("bytes_read", len(data), "walk")
+        except OSError:
+            # Broken symlinks, symlink loops, fifos, ...
+            return contributions
+        for index in pending:
+            visitor = self.visitors[index]
+            metrics.count("files_scanned", 1, visitor.name)
+            if index in streamed_facts:
+                facts = streamed_facts[index]
+            else:
+                with metrics.scope(visitor.name):
+                    if visitor.access is Access.CHUNKS:
+                        facts = visitor.scan_chunks((data,))
+                    elif visitor.access is Access.CONTENT:
+                        facts = visitor.scan_file(path, data)
+                    else:
+                        facts = visitor.scan(first_line(data))
+            if cache is not None and blob is not None:
+                cache.put(blob, visitor.cache_name(path), visitor.version, facts)
+            contributions.append((index, visitor.tally(path, facts)))
+        return contributions
+
+    def stats(self) -> Dict[str, Union[int, str]]:
+        """Stats of all visitors, from the current totals.
+        """
+        stats: Dict[str, Union[int, str]] = {}
+        for visitor, total in zip(self.visitors, self.totals):
+            stats.update(visitor.summarize(+total))
+        if self.visitors:
+            stats["skipped_files"] = self.skipped
+        return stats
+
+
+def walk(
+    tree: Tree,
+    visitors: Sequence[FileVisitor],
+    cache: Optional[BlobCache] = None,
+    prune: Sequence[str] = DEFAULT_PRUNE,
+) -> Dict[str, Union[int, str]]:
+    """Walk the given tree a single time, feeding each file to
+    the interested visitors, and return the stats of all visitors.
+    """
+    tally = Tally(visitors, cache, prune=prune)
+    if visitors:
+        for path in tree.files():
+            tally.add(tree, path)
+    return tally.stats()
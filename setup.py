@@ -20,17 +20,21 @@ setup(
         "console_scripts": [
             "pystyle-crawl=pystyle.crawl:main",
             "pystyle-update=pystyle.update:main",
+            "pystyle-pipeline=pystyle.pipeline:main",
         ]
     },
     install_requires=[
         "feedparser==5.2.1",
         "licensename==0.4.2",
+        "pycodestyle",
         "requests==2.18.4",
-        "requirements-detector",
+        "tomli; python_version < '3.11'",
         "beautifulsoup4==4.6.0",
-        "html5lib==1.0.1",
     ],
-    extras_require={"dev": ["flake8", "mypy", "pylint", "black"]},
+    extras_require={
+        "dev": ["flake8", "mypy", "pylint", "black"],
+        "columnar": ["pyarrow"],
+    },
     license="MIT license",
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",
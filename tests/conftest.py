@@ -1,12 +1,77 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-    Dummy conftest.py for python_style_stats.
-
-    If you don't know what this is for, just leave it empty.
-    Read more about conftest.py under:
-    https://pytest.org/latest/plugins.html
+    Fixtures shared by the tests: small git repositories built commit by
+    commit, in a git environment isolated from the user's configuration.
 """
-from __future__ import print_function, absolute_import, division
+import os
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, Optional
 
 import pytest
+
+Files = Dict[str, Optional[bytes]]
+
+
+@pytest.fixture
+def git_env(monkeypatch):
+    """Isolate git from the user's configuration, with a fixed identity.
+    """
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", "/dev/null")
+    for role in "AUTHOR", "COMMITTER":
+        monkeypatch.setenv(f"GIT_{role}_NAME", "Test")
+        monkeypatch.setenv(f"GIT_{role}_EMAIL", "test@example.com")
+
+
+def run_git(repo: Path, *args: str, **env: str) -> str:
+    """Run a git command in the given repo, giving its output.
+    """
+    return subprocess.check_output(
+        ("git", "-C", str(repo)) + args,
+        universal_newlines=True,
+        env={**os.environ, **env},
+    )
+
+
+@pytest.fixture
+def git(git_env) -> Callable[..., str]:
+    """Run git commands in the isolated environment.
+    """
+    return run_git
+
+
+@pytest.fixture
+def make_repo(tmp_path, git_env) -> Callable[..., Path]:
+    """Build a repository in tmp_path, one commit per given mapping of
+    file paths to contents, None meaning to delete the file. Commits are
+    a day apart.
+    """
+
+    def make_repo(name: str, *commits: Files) -> Path:
+        repo = tmp_path / name
+        repo.mkdir(parents=True)
+        run_git(repo, "init", "-q", "-b", "master")
+        for number, files in enumerate(commits):
+            for path, content in files.items():
+                if content is None:
+                    (repo / path).unlink()
+                else:
+                    (repo / path).parent.mkdir(parents=True, exist_ok=True)
+                    (repo / path).write_bytes(content)
+            date = f"{1_600_000_000 + number * 86400} +0000"
+            run_git(repo, "add", "-A")
+            run_git(
+                repo,
+                "commit",
+                "-q",
+                "--allow-empty",
+                "-m",
+                f"Commit {number}",
+                GIT_AUTHOR_DATE=date,
+                GIT_COMMITTER_DATE=date,
+            )
+        return repo
+
+    return make_repo
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from pystyle import columnar  # noqa: E402  # Needs pyarrow.
+
+STYLES = [
+    {
+        "repo": f"github.com/acme/repo{number}",
+        "commit": f"{number:040}",
+        "date": "2020-01-01T00:00:00+00:00",
+        "license": ("MIT", "BSD-3-Clause", "", "Apache-2.0", "MIT")[number],
+        "test_engine": ("pytest", "", "unittest", "pytest", "nose")[number],
+        "lines_of:py": number * 10,
+        f"shebang:python{number}": 1,
+        "requirements": json.dumps(["six"] * (number % 2)),
+        "versions": json.dumps({"license": 1}),
+    }
+    for number in range(5)
+]
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    monkeypatch.setattr(columnar, "BATCH_SIZE", 2)
+
+
+def read_back(path):
+    if path.suffix == ".arrow":
+        with pa.ipc.open_file(str(path)) as reader:
+            assert reader.num_record_batches == 3
+            return reader.read_all()
+    return pq.read_table(str(path))
+
+
+@pytest.mark.parametrize("name", ["stats.arrow", "stats.parquet"])
+def test_export_columnar(tmp_path, name):
+    columnar.export_columnar(lambda: iter(STYLES), tmp_path / name)
+    table = read_back(tmp_path / name)
+    assert pa.types.is_dictionary(table.schema.field("license").type)
+    assert table.column("license").to_pylist() == [style["license"] for style in STYLES]
+    assert table.column("test_engine").to_pylist() == [
+        style["test_engine"] for style in STYLES
+    ]
+    assert table.column("lines_of:py").to_pylist() == [0, 10, 20, 30, 40]
+    assert table.column("shebang").to_pylist()[3] == [("python3", 1)]
+    assert table.column("requirements").to_pylist()[1] == ["six"]
+
+
+def test_batches_share_dictionaries():
+    schema, dictionaries = columnar.arrow_schema(lambda: iter(STYLES))
+    batches = list(columnar.record_batches(lambda: iter(STYLES), schema, dictionaries))
+    assert len(batches) == 3
+    for batch in batches:
+        assert batch.column("license").dictionary.equals(dictionaries["license"])
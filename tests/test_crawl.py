@@ -0,0 +1,170 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pystyle.crawl import (
+    CloneScheduler,
+    Fetcher,
+    ResolvedProjects,
+    crawl_pypi,
+    crawl_pypi_projects,
+    crawl_pythonwheels,
+    pypi_project_name,
+    to_github_project_url,
+)
+
+
+@pytest.mark.parametrize(
+    "pypi_package_url, name",
+    [
+        # packages.xml links to the project page.
+        ("https://pypi.org/project/requests/", "requests"),
+        # updates.xml links to the page of the release.
+        ("https://pypi.org/project/requests/2.31.0/", "requests"),
+        ("https://pypi.org/project/zope.interface/6.0", "zope.interface"),
+        ("http://127.0.0.1:8000/project/demo/", "demo"),
+        ("https://pypi.org/pypi/requests/json", "requests"),
+    ],
+)
+def test_pypi_project_name(pypi_package_url, name):
+    assert pypi_project_name(pypi_package_url) == name
+
+
+@pytest.mark.parametrize(
+    "url, github_url",
+    [
+        ("https://github.com/psf/requests", "https://github.com/psf/requests"),
+        ("https://github.com/psf/requests.git", "https://github.com/psf/requests"),
+        (
+            "http://www.github.com/psf/requests/tree/main/docs#intro",
+            "https://github.com/psf/requests",
+        ),
+        ("https://gitlab.com/psf/requests", None),
+        (None, None),
+    ],
+)
+def test_to_github_project_url(url, github_url):
+    assert to_github_project_url(url) == github_url
+
+
+def rss(*links):
+    items = "".join(
+        f"<item><title>x</title><link>{link}</link></item>" for link in links
+    )
+    return f'<?xml version="1.0"?><rss version="2.0"><channel>{items}</channel></rss>'
+
+
+class PyPIStandIn(BaseHTTPRequestHandler):
+    """Serves the pages of a tiny PyPI, and of pythonwheels.com, from
+    the `pages` of the server: path → (content, ETag).
+    """
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path not in self.server.pages:
+            self.send_error(404)
+            return
+        content, etag = self.server.pages[self.path]
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pypi():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PyPIStandIn)
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.requests = []
+    server.pages = {
+        "/rss/packages.xml": (rss(f"{server.url}/project/alpha/"), None),
+        "/rss/updates.xml": (rss(f"{server.url}/project/beta/2.0/"), None),
+        "/results.json": (json.dumps({"data": [{"name": "alpha"}]}), None),
+        "/pypi/alpha/json": (
+            json.dumps(
+                {
+                    "info": {
+                        "home_page": "https://alpha.example.com",
+                        "project_urls": {"Source": "https://github.com/acme/alpha"},
+                    }
+                }
+            ),
+            '"alpha-1"',
+        ),
+        "/pypi/beta/json": (
+            json.dumps({"info": {"home_page": "https://github.com/acme/beta/"}}),
+            '"beta-1"',
+        ),
+    }
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def github(tmp_path, make_repo, git, monkeypatch):
+    """Bare repos standing in for github ones: git is configured to
+    clone https://github.com/acme/* from file:// remotes.
+    """
+    remotes = tmp_path / "remotes"
+    for name in "alpha", "beta":
+        repo = make_repo(
+            f"work/{name}", {"setup.py": b"from setuptools import setup\n"}
+        )
+        git(tmp_path, "clone", "-q", "--bare", str(repo), str(remotes / f"{name}.git"))
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", f"url.{remotes.as_uri()}/.insteadOf")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "https://github.com/acme/")
+    return remotes
+
+
+def test_crawl_pypi_feeds(pypi):
+    fetcher = Fetcher(rate=0)
+    assert crawl_pypi(fetcher, pypi.url) == {
+        f"{pypi.url}/project/alpha/",
+        f"{pypi.url}/project/beta/2.0/",
+    }
+    assert crawl_pythonwheels(fetcher, pypi.url, f"{pypi.url}/results.json") == {
+        f"{pypi.url}/project/alpha"
+    }
+
+
+def test_crawl_pypi_projects_clones_resolved_repos(tmp_path, pypi, github, git):
+    git_store = tmp_path / "clones"
+    resolved = ResolvedProjects(tmp_path / "resolved.json")
+    fetcher = Fetcher(rate=0)
+    with CloneScheduler(backoff=0) as scheduler:
+        crawl_pypi_projects(
+            str(git_store), crawl_pypi(fetcher, pypi.url), fetcher, resolved, scheduler
+        )
+    assert scheduler.outcomes == {"cloned": 2}
+    for name in "alpha", "beta":
+        assert git(git_store / "acme" / name, "log", "--format=%s") == "Commit 0\n"
+    assert json.loads((tmp_path / "resolved.json").read_text()) == {
+        "alpha": {"etag": '"alpha-1"', "github_url": "https://github.com/acme/alpha"},
+        "beta": {"etag": '"beta-1"', "github_url": "https://github.com/acme/beta"},
+    }
+    assert ("/pypi/beta/json", None) in pypi.requests
+
+    # Crawling again revalidates the metadata, and leaves clones untouched.
+    pypi.requests.clear()
+    resolved = ResolvedProjects(tmp_path / "resolved.json")
+    with CloneScheduler(backoff=0) as scheduler:
+        crawl_pypi_projects(
+            str(git_store), crawl_pypi(fetcher, pypi.url), fetcher, resolved, scheduler
+        )
+    assert scheduler.outcomes == {"unchanged": 2}
+    assert ("/pypi/alpha/json", '"alpha-1"') in pypi.requests
+    assert ("/pypi/beta/json", '"beta-1"') in pypi.requests
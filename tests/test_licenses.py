@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import licensename
+import pytest
+
+from pystyle.licenses import COMMON_LICENSES, license_fingerprint
+from pystyle.update import LicenseIdentifier
+
+BSD_3_CLAUSE = """BSD 3-Clause License
+
+Copyright (c) 2020, Acme
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+ISC = """ISC License
+
+Copyright (c) 2020, Acme
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+"""
+
+COMMON_LICENSES_DIR = Path("/usr/share/common-licenses")
+
+
+def untitled(text):
+    return text.split("\n", 2)[2]
+
+
+@pytest.mark.parametrize(
+    "text", [BSD_3_CLAUSE, untitled(BSD_3_CLAUSE), ISC, untitled(ISC)]
+)
+def test_common_license_texts_are_known(text):
+    assert COMMON_LICENSES[license_fingerprint(text)] == licensename.from_text(text)
+
+
+@pytest.mark.parametrize(
+    "name", ["Apache-2.0", "GPL-2", "GPL-3", "LGPL-2.1", "LGPL-3", "MPL-2.0"]
+)
+def test_debian_license_texts_are_known(name):
+    if not (COMMON_LICENSES_DIR / name).exists():
+        pytest.skip(f"No {name} text in {COMMON_LICENSES_DIR}")
+    text = (COMMON_LICENSES_DIR / name).read_text()
+    assert COMMON_LICENSES[license_fingerprint(text)] == licensename.from_text(text)
+
+
+def test_common_licenses_skip_licensename(monkeypatch):
+    def from_text(text):
+        raise AssertionError("licensename should not be called")
+
+    monkeypatch.setattr(licensename, "from_text", from_text)
+    other_holder = BSD_3_CLAUSE.replace("2020, Acme", "1999-2004, Someone Else")
+    facts = LicenseIdentifier().scan(other_holder.encode())
+    assert facts == {"license:BSD-3-Clause": 1}
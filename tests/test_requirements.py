@@ -0,0 +1,125 @@
+from pathlib import PurePosixPath
+
+import pytest
+
+from pystyle.requirements import find_requirements, requirements_format
+
+
+@pytest.mark.parametrize(
+    "path, file_format",
+    [
+        ("setup.py", "setup.py"),
+        ("setup.cfg", "setup.cfg"),
+        ("pyproject.toml", "pyproject.toml"),
+        ("Pipfile", "Pipfile"),
+        ("requirements.txt", "requirements.txt"),
+        ("requirements-dev.txt", "requirements.txt"),
+        ("requirements/base.txt", "requirements.txt"),
+        ("requirements/base.in", None),
+        ("docs/requirements.txt", None),
+        ("src/pkg/setup.py", None),
+        ("Pipfile.lock", None),
+    ],
+)
+def test_requirements_format(path, file_format):
+    assert requirements_format(PurePosixPath(path)) == file_format
+
+
+REQUIREMENTS_TXT = [
+    ("requests\nflask==1.0\n", ["requests", "flask==1.0"]),
+    (
+        "# Web\nrequests>=2.0  # HTTP\n\n   # indented\nflask\n",
+        ["requests>=2.0", "flask"],
+    ),
+    ("-r base.txt\n--requirement=dev.txt\n-c constraints.txt\nsix\n", ["six"]),
+    ("-e .\n-e git+https://github.com/acme/lib.git#egg=lib\n--index-url x\n", []),
+    ("git+https://github.com/acme/lib.git\nhttps://example.com/lib.zip\n", []),
+    ('pywin32>=1.0; sys_platform == "win32"\n', ["pywin32>=1.0"]),
+    ("requests[security, socks] >= 2.8.1, == 2.8.*\n", ["requests>=2.8.1,==2.8.*"]),
+    ("lib @ https://example.com/lib.zip\n", ["lib"]),
+    ("django==3.0 \\\n    --hash=sha256:0123\n", ["django==3.0"]),
+    ("Django (>=1.11)\n", ["Django>=1.11"]),
+]
+
+
+SETUP_PY = [
+    (
+        "from setuptools import setup\n"
+        "setup(name='x', install_requires=['a>=1', 'b'])\n",
+        ["a>=1", "b"],
+    ),
+    (
+        "import setuptools\nREQUIRES = ('a', 'b; python_version < \"3\"')\n"
+        "setuptools.setup(install_requires=REQUIRES)\n",
+        ["a", "b"],
+    ),
+    ("from setuptools import setup\nsetup(install_requires='a\\nb>2')\n", ["a", "b>2"]),
+    (
+        "from setuptools import setup\n"
+        "setup(install_requires=open('requirements.txt').read().splitlines())\n",
+        [],
+    ),
+    ("from setuptools import setup\nsetup(name='x')\n", []),
+    ("print('no setup call')\n", []),
+    ("from setuptools import setup\nsetup(install_requires=[\n", []),
+    ("print 'Python 2'\n", []),
+]
+
+
+SETUP_CFG = [
+    (
+        "[metadata]\nname = x\n\n[options]\ninstall_requires =\n"
+        "    a>=1\n    # comment\n    b; python_version < '3.8'\n",
+        ["a>=1", "b"],
+    ),
+    ("[metadata]\nname = x\n", []),
+    ("not an ini file\n", []),
+]
+
+
+PYPROJECT_TOML = [
+    (
+        '[project]\nname = "x"\n'
+        'dependencies = ["a>=1", "b[extra]; python_version < \'3.8\'"]\n',
+        ["a>=1", "b"],
+    ),
+    (
+        '[tool.poetry.dependencies]\npython = "^3.8"\na = "*"\nb = ">=2,<3"\n'
+        'c = {version = "==1.0", optional = true}\nd = {path = "../d"}\n'
+        '\n[tool.poetry.dev-dependencies]\npytest = "*"\n',
+        ["a", "b>=2,<3", "c==1.0", "d"],
+    ),
+    ('[tool.poetry.dependencies]\nrequests = "^2.25"\n', ["requests"]),
+    (
+        '[project]\ndependencies = ["a"]\n\n[tool.poetry.dependencies]\nb = "*"\n',
+        ["a", "b"],
+    ),
+    ('[build-system]\nrequires = ["setuptools"]\n', []),
+    ("[project\n", []),
+]
+
+
+PIPFILE = [
+    (
+        '[packages]\nrequests = "*"\ndjango = {version = ">=3"}\n'
+        '\n[dev-packages]\npytest = "*"\n',
+        ["requests", "django>=3"],
+    ),
+    ('[dev-packages]\npytest = "*"\n', []),
+]
+
+
+@pytest.mark.parametrize(
+    "file_format, text, requirements",
+    [("requirements.txt", *case) for case in REQUIREMENTS_TXT]
+    + [("setup.py", *case) for case in SETUP_PY]
+    + [("setup.cfg", *case) for case in SETUP_CFG]
+    + [("pyproject.toml", *case) for case in PYPROJECT_TOML]
+    + [("Pipfile", *case) for case in PIPFILE],
+)
+def test_find_requirements(file_format, text, requirements):
+    assert find_requirements(file_format, text.encode()) == requirements
+
+
+def test_find_requirements_in_undecodable_file():
+    assert find_requirements("requirements.txt", b"caf\xe9\n") == []
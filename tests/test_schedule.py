@@ -0,0 +1,32 @@
+import signal
+import subprocess
+import time
+
+import pytest
+
+from pystyle.schedule import TaskTimeout, time_limit
+from pystyle.tree import CatFile
+
+
+def test_time_limit_interrupts_subprocess():
+    start = time.monotonic()
+    with pytest.raises(TaskTimeout):
+        with time_limit(0.2):
+            subprocess.run(("sleep", "10"))
+    assert time.monotonic() - start < 5
+
+
+def test_catfile_killed_on_timeout(make_repo):
+    repo = make_repo("repo", {"a.py": b"pass\n"})
+    with pytest.raises(TaskTimeout):
+        with time_limit(0.2), CatFile(repo) as cat_file:
+            assert cat_file.read("HEAD:a.py") == b"pass\n"
+            time.sleep(10)
+    assert cat_file.process.returncode == -signal.SIGKILL
+
+
+def test_catfile_stopped_by_closing_its_input(make_repo):
+    repo = make_repo("repo", {"a.py": b"pass\n"})
+    with CatFile(repo) as cat_file:
+        assert cat_file.read("HEAD:a.py") == b"pass\n"
+    assert cat_file.process.returncode == 0
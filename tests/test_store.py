@@ -0,0 +1,135 @@
+import csv
+import json
+
+import pytest
+
+from pystyle.store import StatsJSONL, StatsStore, drop_partial_line, read_jsonl
+from pystyle.update import Options, infer_style_of_all_repos
+
+STYLES = [
+    {"repo": "acme/a", "commit": "a1", "date": "2020-01-01", "x": 1, "y": "py"},
+    {"repo": "acme/a", "commit": "a2", "date": "2020-02-01", "x": 2},
+    {"repo": "acme/b", "commit": "b1", "date": "2020-03-01", "z": 3, "x": 3},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    with StatsStore(tmp_path / "stats.db") as store:
+        for style in STYLES:
+            store.write(style)
+        yield store
+
+
+@pytest.mark.parametrize(
+    "content, kept",
+    [
+        (b"", b""),
+        (b'{"a": 1}\n', b'{"a": 1}\n'),
+        (b'{"a": 1}\n{"b": 2}\n{"c"', b'{"a": 1}\n{"b": 2}\n'),
+        (b'{"c": "', b""),
+        (b'{"a": 1}\n{"b": "' + b"x" * 100, b'{"a": 1}\n'),
+    ],
+)
+def test_drop_partial_line(tmp_path, content, kept):
+    path = tmp_path / "stats.jsonl"
+    path.write_bytes(content)
+    drop_partial_line(path, block_size=16)
+    assert path.read_bytes() == kept
+
+
+def test_drop_partial_line_of_missing_file(tmp_path):
+    drop_partial_line(tmp_path / "missing.jsonl")
+    assert not (tmp_path / "missing.jsonl").exists()
+
+
+def test_resume_after_partial_write(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    path.write_text('{"repo": "a"}\n{"repo": "b"}\n{"repo": "c", "lin')
+    with StatsJSONL(path, resume=True) as writer:
+        assert writer.repos() == {"a", "b"}
+        writer.write({"repo": "c"})
+        writer.done()
+        assert [style["repo"] for style in read_jsonl(path)] == ["a", "b", "c"]
+
+
+def test_no_resume_starts_over(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    path.write_text(json.dumps({"repo": "a"}) + "\n")
+    with StatsJSONL(path) as writer:
+        assert writer.repos() == set()
+
+
+def test_store_reads_back_styles(store):
+    assert list(store.styles()) == STYLES
+    assert store.repos() == {"acme/a", "acme/b"}
+
+
+def test_store_upserts_metrics(store):
+    store.write({**STYLES[0], "x": 10, "w": 4})
+    assert list(store.styles(repo="acme/a")) == [
+        {**STYLES[0], "x": 10, "w": 4},
+        STYLES[1],
+    ]
+
+
+def test_store_regroups_metrics_written_apart(store):
+    store.write({"repo": "acme/a", "commit": "a1", "date": "2020-01-01", "w": 4})
+    assert list(store.styles()) == [{**STYLES[0], "w": 4}] + STYLES[1:]
+
+
+def test_store_deletes_dropped_metrics(store):
+    store.write({"repo": "acme/a", "commit": "a1", "date": "2020-01-01"}, ["y"])
+    assert next(store.styles()) == {
+        "repo": "acme/a",
+        "commit": "a1",
+        "date": "2020-01-01",
+        "x": 1,
+    }
+
+
+@pytest.mark.parametrize(
+    "filters, commits",
+    [
+        ({"repo": "acme/a"}, ["a1", "a2"]),
+        ({"repo": "acme/c"}, []),
+        ({"since": "2020-02-01"}, ["a2", "b1"]),
+        ({"until": "2020-02-01"}, ["a1"]),
+        ({"repo": "acme/a", "since": "2020-01-15", "until": "2020-03-01"}, ["a2"]),
+    ],
+)
+def test_store_filters_styles(store, filters, commits):
+    assert [style["commit"] for style in store.styles(**filters)] == commits
+
+
+def test_store_exports_csv(tmp_path, store):
+    stats_csv = tmp_path / "stats.csv"
+    store.export_csv(stats_csv)
+    with open(stats_csv) as csv_file:
+        reader = csv.DictReader(csv_file, dialect=csv.unix_dialect)
+        assert reader.fieldnames == ["x", "y", "z", "commit", "repo", "date"]
+        assert [row["x"] for row in reader] == ["1", "2", "3"]
+
+
+def test_store_resume_skips_stored_repos(tmp_path, make_repo):
+    git_store = tmp_path / "git"
+    make_repo("git/github.com/acme/done", {"a.py": b"pass\n"})
+    make_repo("git/github.com/acme/new", {"a.py": b"pass\n"})
+    stats_db = tmp_path / "stats.db"
+    stored = {
+        "repo": "github.com/acme/done",
+        "commit": "0" * 40,
+        "date": "2020-01-01",
+        "x": 1,
+    }
+    with StatsStore(stats_db) as store:
+        store.write(stored)
+    infer_style_of_all_repos(
+        git_store, tmp_path / "stats.csv", Options(jobs=1), resume=True, store=stats_db
+    )
+    with StatsStore(stats_db) as store:
+        assert list(store.styles(repo="github.com/acme/done")) == [stored]
+        assert [style["repo"] for style in store.styles()] == [
+            "github.com/acme/done",
+            "github.com/acme/new",
+        ]
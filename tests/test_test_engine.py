@@ -0,0 +1,44 @@
+import pytest
+
+from pystyle.tree import WorkTree
+from pystyle.update import TestEngineDetector
+from pystyle.walk import walk
+
+
+@pytest.mark.parametrize(
+    "files, engine",
+    [
+        ({}, ""),
+        ({"setup.py": b"from setuptools import setup\n"}, ""),
+        ({"tests/conftest.py": b""}, "pytest"),
+        ({"tests/test_pkg.py": b"import unittest\n"}, "unittest"),
+        ({"tests/test_pkg.py": b"from nose.tools import eq_\n"}, "nose"),
+        ({"pkg.py": b"x = 'import pytest'\n"}, ""),
+        ({"README.md": b"\xff\xfeRun the tests with nose\n\xff"}, "nose"),
+        ({"docs/README.md": b"Run the tests with nose\n"}, ""),
+        (
+            {
+                "tox.ini": b"commands = nosetests\n",
+                "setup.cfg": b"[nosetests]\n",
+                "README.rst": b"We used pytest once\n",
+                "a.py": b"import unittest\n",
+                "b.py": b"import unittest\n",
+            },
+            "nose",
+        ),
+        (
+            {
+                "README.rst": b"Run the tests with nose\n",
+                "tests/conftest.py": b"",
+                "tests/test_pkg.py": b"import pytest\n",
+            },
+            "pytest",
+        ),
+    ],
+)
+def test_detect_test_engine(tmp_path, files, engine):
+    for path, content in files.items():
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(content)
+    stats = walk(WorkTree(tmp_path), [TestEngineDetector()])
+    assert stats["test_engine"] == engine
@@ -0,0 +1,22 @@
+from pystyle.tree import WorkTree
+from pystyle.update import Options, infer_style
+
+
+def test_worktree_of_empty_index_has_no_files(make_repo):
+    repo = make_repo("empty", {})
+    (repo / "stray.py").write_bytes(b"#!/usr/bin/env python2\n")
+    assert list(WorkTree(repo).files()) == []
+
+
+def test_worktree_outside_git_walks_all_files(tmp_path):
+    (tmp_path / "pkg" / ".git").mkdir(parents=True)
+    (tmp_path / "pkg" / ".git" / "HEAD").write_bytes(b"")
+    (tmp_path / "pkg" / "setup.py").write_bytes(b"")
+    assert [str(path) for path in WorkTree(tmp_path).files()] == ["pkg/setup.py"]
+
+
+def test_untracked_files_of_empty_checkout_are_ignored(make_repo):
+    repo = make_repo("empty", {})
+    (repo / "stray.py").write_bytes(b"#!/usr/bin/env python2\n")
+    style = infer_style(repo, Options(checkout=True), None)
+    assert not [key for key in style if key.startswith("shebang:")]
@@ -0,0 +1,248 @@
+import csv
+import json
+
+import pytest
+
+from pystyle.store import StatsStore, read_jsonl
+from pystyle.update import (
+    ANALYZER_COLUMNS,
+    FILE_VISITORS,
+    METHODS,
+    Options,
+    ShebangCounter,
+    analyzer_columns,
+    commit,
+    count_commits,
+    failures_path,
+    infer_style,
+    infer_style_history,
+    infer_style_of_all_repos,
+    random_commit,
+    update_style,
+    update_style_of_all_repos,
+    update_style_of_store,
+)
+
+ANALYZERS = {**METHODS, **FILE_VISITORS}
+
+MIT = b"""MIT License
+
+Copyright (c) 2020 Acme
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+HISTORY = (
+    {
+        "setup.py": b"from setuptools import setup\nsetup(install_requires=['six'])\n",
+        "pkg/__init__.py": b"from __future__ import annotations\nx=1\n",
+        "LICENSE": MIT,
+        "requirements.txt": b"requests>=2  # HTTP\n",
+        "venv/lib/site.py": b"import pytest\n",
+    },
+    {
+        # Renamed package, new tests, and a vendored module.
+        "pkg/__init__.py": None,
+        "src/pkg/__init__.py": b"from __future__ import annotations\nx=1\n",
+        "tests/test_pkg.py": b"import pytest\n\n\ndef test():\n    assert 1\n",
+        "vendor/six.py": b"#!/usr/bin/env python2\nimport nose\n",
+    },
+    {
+        "requirements.txt": None,
+        "setup.py": (
+            b"from setuptools import setup\nsetup(install_requires=['attrs'])\n"
+        ),
+        "script.py": b"#!/usr/bin/env python3\nprint( 'hello' )\n",
+        "data.json": b'{"a": 1}',
+    },
+    {
+        "vendor/six.py": None,
+        "node_modules/pkg/index.py": b"import unittest\n",
+        "tests/conftest.py": b"",
+    },
+    {
+        "LICENSE": None,
+        "LICENSE.txt": MIT,
+        "src/pkg/__init__.py": None,
+        "src/pkg/core.py": b"from __future__ import annotations\nx=1\n",
+        "docs/index.rst": b"Docs\n",
+    },
+)
+
+
+@pytest.mark.parametrize("cached", [False, True])
+@pytest.mark.parametrize("samples", [2, 3, len(HISTORY)])
+def test_history_equals_full_analyses(tmp_path, make_repo, samples, cached):
+    """Only files changed between samples are read, which should give
+    the same stats as analyzing each sampled commit from scratch.
+    """
+    repo = make_repo("history", *HISTORY)
+    cache = tmp_path / "cache.sqlite" if cached else None
+    history = infer_style_history(repo, Options(history=samples, cache=cache))
+    assert len(history) == samples
+    for style in history:
+        assert style == infer_style(repo, Options(checkout=False), style["commit"])
+
+
+@pytest.mark.parametrize("content", ["", "garbage", "{commit} many\n", "{commit}\n"])
+def test_count_commits_recounts_corrupt_cache(make_repo, git, content):
+    repo = make_repo("counted", *HISTORY)
+    commit = git(repo, "rev-parse", "HEAD").strip()
+    counts_file = repo / ".git" / "pystyle-commit-count"
+    counts_file.write_text(content.format(commit=commit))
+    assert count_commits(repo) == len(HISTORY)
+    assert counts_file.read_text() == f"{commit} {len(HISTORY)}\n"
+
+
+def test_checkouts_restore_the_branch(make_repo, git):
+    repo = make_repo("branch", *HISTORY)
+    infer_style(repo, Options(checkout=True))
+    with commit(repo, git(repo, "rev-list", "--max-parents=0", "HEAD").strip()):
+        pass
+    assert git(repo, "symbolic-ref", "--short", "HEAD").strip() == "master"
+
+
+def test_fix_checkout_prefers_default_branch(tmp_path, make_repo, git, capfd):
+    upstream = make_repo("upstream", *HISTORY[:2])
+    git(upstream, "branch", "aaa", "HEAD~1")
+    clone = tmp_path / "clone"
+    git(tmp_path, "clone", "-q", str(upstream), str(clone))
+    git(clone, "branch", "-q", "aaa", "origin/aaa")
+    git(clone, "checkout", "-q", "--detach")
+    capfd.readouterr()
+    random_commit(clone).fix_checkout()
+    assert capfd.readouterr() == ("", "")
+    assert git(clone, "symbolic-ref", "--short", "HEAD").strip() == "master"
+
+
+def test_broken_repos_are_recorded_as_failures(tmp_path, make_repo):
+    git_store = tmp_path / "store"
+    make_repo("store/github.com/acme/ok", {"a.py": b"pass\n"})
+    make_repo("store/github.com/acme/empty")
+    stats_csv = tmp_path / "stats.csv"
+    infer_style_of_all_repos(git_store, stats_csv, Options(jobs=1))
+    assert [style["repo"] for style in read_jsonl(stats_csv.with_suffix(".jsonl"))] == [
+        "github.com/acme/ok"
+    ]
+    assert list(read_jsonl(failures_path(stats_csv))) == [
+        {"repo": "github.com/acme/empty", "commit": None, "reason": "error"}
+    ]
+
+
+def test_analyzer_columns_cover_all_stats(make_repo):
+    repo = make_repo("columns", *HISTORY)
+    style = infer_style(repo, Options(checkout=False), "HEAD")
+    for key in set(style) - {"commit", "repo", "date", "versions", "skipped_files"}:
+        owners = [
+            name for name in ANALYZER_COLUMNS if analyzer_columns({key: 1}, [name])
+        ]
+        assert len(owners) == 1, key
+
+
+@pytest.fixture
+def outdated_shebangs(tmp_path, make_repo):
+    """A git store whose single repo has a python3 shebang, and a stats
+    line for it computed by an older shebang counter, which gave a
+    python2.7 column, and by the current has_file analyzer.
+    """
+    git_store = tmp_path / "store"
+    make_repo(
+        "store/github.com/acme/demo",
+        {"script.py": b"#!/usr/bin/env python3\n", "setup.py": b""},
+    )
+    stats_csv = tmp_path / "stats.csv"
+    infer_style_of_all_repos(git_store, stats_csv, Options(checkout=False, jobs=1))
+    (line,) = read_jsonl(stats_csv.with_suffix(".jsonl"))
+    versions = json.loads(line["versions"])
+    line["versions"] = json.dumps({**versions, "shebang": 0}, sort_keys=True)
+    line["shebang:python2.7"] = 7
+    line["file:setup.py"] = 42
+    return git_store, stats_csv, line
+
+
+def check_updated(style):
+    assert "shebang:python2.7" not in style or style["shebang:python2.7"] == ""
+    assert str(style["shebang:python3"]) == "1"
+    assert str(style["file:setup.py"]) == "42"  # Up to date, not rerun.
+    assert json.loads(style["versions"])["shebang"] == ShebangCounter.version
+
+
+def test_update_drops_columns_of_rerun_analyzers(outdated_shebangs):
+    git_store, stats_csv, line = outdated_shebangs
+    with open(stats_csv, "w") as csv_file:
+        writer = csv.DictWriter(
+            csv_file, fieldnames=list(line), dialect=csv.unix_dialect
+        )
+        writer.writeheader()
+        writer.writerow(line)
+    update_style_of_all_repos(git_store, stats_csv, Options(checkout=False, jobs=1))
+    with open(stats_csv.with_name("stats-new.csv")) as csv_file:
+        (style,) = csv.DictReader(csv_file, dialect=csv.unix_dialect)
+    check_updated(style)
+
+
+def test_update_store_deletes_metrics_of_rerun_analyzers(tmp_path, outdated_shebangs):
+    git_store, stats_csv, line = outdated_shebangs
+    with StatsStore(tmp_path / "stats.db") as store:
+        store.write(line)
+    update_style_of_store(
+        git_store, tmp_path / "stats.db", stats_csv, Options(checkout=False, jobs=1)
+    )
+    with StatsStore(tmp_path / "stats.db") as store:
+        (style,) = store.styles()
+    check_updated(style)
+
+
+def test_update_keeps_up_to_date_lines(outdated_shebangs):
+    git_store, _, line = outdated_shebangs
+    line["versions"] = json.dumps(
+        {name: getattr(analyzer, "version", 1) for name, analyzer in ANALYZERS.items()}
+    )
+    assert update_style(git_store, Options(), dict(line)) == line
+
+
+@pytest.mark.parametrize("checkout", [True, False])
+def test_update_keeps_lines_failing_to_update(outdated_shebangs, checkout):
+    git_store, stats_csv, line = outdated_shebangs
+    missing = {**line, "commit": "0" * 40}
+    with open(stats_csv, "w") as csv_file:
+        writer = csv.DictWriter(
+            csv_file, fieldnames=list(line), dialect=csv.unix_dialect
+        )
+        writer.writeheader()
+        writer.writerows([missing, line])
+    update_style_of_all_repos(git_store, stats_csv, Options(checkout=checkout, jobs=1))
+    with open(stats_csv.with_name("stats-new.csv")) as csv_file:
+        kept, updated = csv.DictReader(csv_file, dialect=csv.unix_dialect)
+    assert kept == {key: str(value) for key, value in missing.items()}
+    check_updated(updated)
+
+
+def test_resume_after_killed_run(tmp_path, make_repo):
+    git_store = tmp_path / "store"
+    make_repo("store/github.com/acme/ok", {"a.py": b"pass\n"})
+    make_repo("store/github.com/acme/empty")
+    stats_csv = tmp_path / "stats.csv"
+    infer_style_of_all_repos(git_store, stats_csv, Options(jobs=1))
+    for path in stats_csv.with_suffix(".jsonl"), failures_path(stats_csv):
+        with open(path, "a") as jsonl_file:
+            jsonl_file.write('{"repo": "github.com/acme/ha')
+    infer_style_of_all_repos(git_store, stats_csv, Options(jobs=1), resume=True)
+    assert len(list(read_jsonl(stats_csv.with_suffix(".jsonl")))) == 1
+    assert len(list(read_jsonl(failures_path(stats_csv)))) == 1
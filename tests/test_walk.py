@@ -0,0 +1,48 @@
+from pathlib import PurePosixPath
+
+import pytest
+
+from pystyle import walk
+from pystyle.tree import WorkTree
+from pystyle.update import LinesOfCodeCounter
+
+
+@pytest.mark.parametrize(
+    "chunks, facts",
+    [
+        ((), {"lines": 0}),
+        ((b"",), {"lines": 0}),
+        ((b"a\n", b"b\n"), {"lines": 2}),
+        ((b"a\n", b"b"), {"lines": 2}),
+        ((b"a", b"", b"b"), {"lines": 1}),
+        ((b"a\n", b"b\n", b""), {"lines": 2}),
+        ((b"a\n", b"b\0"), {"binary": 1}),
+        ((b"a\n" * 4000, b"\0"), {"lines": 4001}),
+    ],
+)
+def test_count_lines_of_chunks(chunks, facts):
+    assert LinesOfCodeCounter().scan_chunks(chunks) == facts
+
+
+@pytest.mark.parametrize(
+    "content, lines",
+    [
+        (b"", None),
+        (b"a\nbb\nccc\n", 3),
+        (b"a\nbb\nccc", 3),
+        (b"a long first line\nb\n", 2),
+        (b"a long first line", 1),
+        (b"a\nbbbbbbbbbbbb\0\n", None),
+        (b"a long first line\0\n", None),
+    ],
+)
+def test_tally_streams_chunks(tmp_path, monkeypatch, content, lines):
+    """With a single chunked visitor, files are read chunk by chunk,
+    the first chunk being their first line, up to CHUNK_SIZE bytes.
+    """
+    monkeypatch.setattr(walk, "CHUNK_SIZE", 4)
+    (tmp_path / "file.py").write_bytes(content)
+    tally = walk.Tally([LinesOfCodeCounter()])
+    tally.add(WorkTree(tmp_path), PurePosixPath("file.py"))
+    expected = {} if lines is None else {"lines_of:py": lines}
+    assert tally.stats() == {**expected, "skipped_files": 0}